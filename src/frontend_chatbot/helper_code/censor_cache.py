@@ -0,0 +1,142 @@
+"""
+This file contains the persistent cache of the censored open feedback used by the hospital_data
+module.
+
+Censoring a text with spaCy always gives the same result for the same model, so the censored
+texts are stored in a SQLite database on disk, keyed by the sha256 hash of the text and by the
+version of the model (see hospital_data._get_censor_model_version()). Texts censored by one
+process are then found by all other processes (e.g. several app workers or containers sharing
+the cache directory) and after a restart, and only the texts that are not in the cache are 
+censored.
+
+The database uses write-ahead logging, so that several processes can read the cache while
+another process writes to it. Each thread (and each process after a fork) opens its own
+connection. Errors of the database (e.g. a read-only or full disk) are printed and the texts are
+then censored as if they were not in the cache.
+
+CensorCache provides:
+- get_many(texts, model_version): returns the censored texts found in the cache
+- put_many(censored, model_version): adds censored texts to the cache
+- get_stats(): returns the number of hits and misses of the process, the hit rate and the
+number of entries and size of the database
+
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+
+# Maximum number of texts looked up in one query (SQLite limits the number of parameters)
+LOOKUP_CHUNK_SIZE = 500
+# Time to wait for another process writing to the database, in seconds
+BUSY_TIMEOUT = 30
+
+
+def text_hash(text):
+    """
+    text: a text (string)
+    Returns the sha256 digest of the text encoded as UTF-8 (bytes).
+    """
+    return hashlib.sha256(text.encode("utf-8", "surrogatepass")).digest()
+
+
+class CensorCache:
+    """
+    Censored texts stored in a SQLite database, keyed by text hash and model version.
+    """
+
+    def __init__(self, path):
+        """
+        path: path of the database file (string), created with its directory if needed
+        """
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        """
+        Returns the connection of the current thread, opening it if needed (a connection opened
+        before a fork is never used by the child process).
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is not None and self.local.pid == os.getpid():
+            return connection
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS censored (hash BLOB NOT NULL, "
+                           "model TEXT NOT NULL, censored TEXT NOT NULL, "
+                           "PRIMARY KEY (hash, model)) WITHOUT ROWID")
+        connection.commit()
+        self.local.connection = connection
+        self.local.pid = os.getpid()
+        return connection
+
+    def get_many(self, texts, model_version):
+        """
+        texts: the texts to look up (list of strings)
+        model_version: the version of the model the texts are censored with (string)
+        Returns a dictionary from text to censored text for the texts found in the cache.
+        """
+        hashes = {text_hash(text): text for text in texts}
+        found = {}
+        try:
+            connection = self._connect()
+            keys = list(hashes)
+            for i in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+                chunk = keys[i:i + LOOKUP_CHUNK_SIZE]
+                rows = connection.execute(
+                    f"SELECT hash, censored FROM censored WHERE model = ? AND hash IN "
+                    f"({', '.join('?' * len(chunk))})", [model_version] + chunk)
+                for key, censored_text in rows:
+                    found[hashes[key]] = censored_text
+        except (sqlite3.Error, OSError) as e:
+            print("Could not read the censor cache: ", self.path, e)
+        with self.lock:
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        return found
+
+    def put_many(self, censored, model_version):
+        """
+        censored: dictionary from text to censored text
+        model_version: the version of the model the texts were censored with (string)
+        Adds the censored texts to the cache in one transaction (texts already in the cache,
+        e.g. censored by another process in the meantime, are kept).
+        """
+        if len(censored) == 0:
+            return
+        rows = [(text_hash(text), model_version, censored_text)
+                for text, censored_text in censored.items()]
+        try:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    "INSERT OR IGNORE INTO censored (hash, model, censored) VALUES (?, ?, ?)", rows)
+        except (sqlite3.Error, OSError) as e:
+            print("Could not write the censor cache: ", self.path, e)
+
+    def get_stats(self):
+        """
+        Returns a dictionary with the number of hits and misses of the lookups of this process,
+        the hit rate (None if there were no lookups), the number of entries in the cache and the
+        size of the database files in bytes.
+        """
+        with self.lock:
+            stats = {"hits": self.hits, "misses": self.misses}
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups > 0 else None
+        try:
+            stats["entries"] = self._connect().execute("SELECT COUNT(*) FROM censored").fetchone()[0]
+        except (sqlite3.Error, OSError) as e:
+            print("Could not read the censor cache: ", self.path, e)
+            stats["entries"] = None
+        stats["size"] = sum(os.path.getsize(self.path + suffix) for suffix in ["", "-wal"]
+                            if os.path.isfile(self.path + suffix))
+        return stats
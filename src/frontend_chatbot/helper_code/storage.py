@@ -0,0 +1,320 @@
+"""
+This file contains the storage backends the data_loader module reads the state files from.
+
+Backends:
+- LocalStorage: the files are read from a local directory (e.g. a volume mounted on /data/).
+- ObjectStorage: the files are read from an object store bucket. They are downloaded in chunks
+to a local directory, validating the md5 checksum of the object, and are only downloaded again
+when the object in the bucket changes, so the data_loader module can always work on local files.
+
+Object stores (used by ObjectStorage):
+- GCSObjectStore: a Google Cloud Storage bucket (requires the google-cloud-storage package and
+credentials, as for the vec_db and llm_server containers).
+- FilesystemObjectStore: a local directory that behaves like a bucket. It can stand in for a
+bucket for local deployment and testing.
+
+get_storage() selects the backend from the DATA_BUCKET environment variable:
+- not set: LocalStorage reading from the data path
+- "gs://bucket_name" or "bucket_name": ObjectStorage on the GCS bucket
+- "file:///absolute/path": ObjectStorage on a FilesystemObjectStore in the given directory
+
+All backends provide:
+- list_files(): returns the names of the files
+- get_version(): returns a value that changes whenever files are added, removed or changed
+- get_path(filename): returns the local path of a file (downloading it if needed), or None if
+the file does not exist
+
+"""
+
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import namedtuple
+
+# Size of the chunks used to download and hash files
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# name: object name, size: size in bytes, md5: base64 encoded md5 digest (None if unknown)
+ObjectInfo = namedtuple("ObjectInfo", ["name", "size", "md5"])
+
+
+def get_storage(data_path, download_path):
+    """
+    data_path: directory the files are read from if no bucket is configured
+    download_path: directory the files are downloaded to if a bucket is configured
+    Returns the storage backend selected by the DATA_BUCKET environment variable.
+    """
+    bucket = os.environ.get("DATA_BUCKET")
+    if not bucket:
+        return LocalStorage(data_path)
+    if bucket.startswith("file://"):
+        return ObjectStorage(FilesystemObjectStore(bucket[len("file://"):]), download_path)
+    if bucket.startswith("gs://"):
+        bucket = bucket[len("gs://"):]
+    return ObjectStorage(GCSObjectStore(bucket), download_path)
+
+def md5_of_file(path):
+    """
+    path: path to a local file
+    Returns the base64 encoded md5 digest of the file (the format used by GCS).
+    """
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            md5.update(chunk)
+    return base64.b64encode(md5.digest()).decode()
+
+
+#region BACKENDS
+
+class LocalStorage:
+    """
+    Reads the files from a local directory.
+    """
+
+    def __init__(self, path):
+        """
+        path: the directory containing the files (string)
+        """
+        self.path = path
+
+    def list_files(self):
+        """
+        Returns the names of the files in the directory.
+        """
+        return os.listdir(self.path)
+
+    def get_version(self):
+        """
+        Returns the modification time of the directory, which changes whenever files are added,
+        removed or renamed.
+        """
+        return os.stat(self.path).st_mtime_ns
+
+    def get_path(self, filename):
+        """
+        filename: name of the file (string)
+        Returns the path of the file, or None if the file does not exist.
+        """
+        path = os.path.join(self.path, filename)
+        if not os.path.isfile(path):
+            return None
+        return path
+
+
+class ObjectStorage:
+    """
+    Reads the files from an object store, keeping a local copy of each file in a download
+    directory. A file is downloaded again only if its size or checksum in the object store
+    differs from the local copy. Each file is checked and downloaded by one thread at a time, 
+    and downloads write to temporary files with unique names, so that concurrent downloads 
+    (e.g. by other processes) never write to the same file.
+    """
+
+    def __init__(self, store, path):
+        """
+        store: the object store (GCSObjectStore or FilesystemObjectStore)
+        path: the directory the files are downloaded to (string)
+        """
+        self.store = store
+        self.path = path
+        # locks of the files, so that each file is only downloaded once at a time
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+
+    def list_files(self):
+        """
+        Returns the names of the objects in the store.
+        """
+        return [o.name for o in self.store.list_objects()]
+
+    def get_version(self):
+        """
+        Returns the names, sizes and checksums of all objects in the store.
+        """
+        return tuple(sorted(self.store.list_objects()))
+
+    def get_path(self, filename):
+        """
+        filename: name of the object (string)
+        Returns the path of the local copy of the object, downloading it if the local copy
+        is missing or differs from the object in the store.
+        Returns None if the object does not exist.
+        """
+        info = self.store.get_object(filename)
+        if info is None:
+            return None
+        path = os.path.join(self.path, filename)
+        with self.locks_lock:
+            lock = self.locks.setdefault(filename, threading.Lock())
+        with lock:
+            if not self._is_up_to_date(path, info):
+                self._download(info, path)
+        return path
+
+    def _is_up_to_date(self, path, info):
+        """
+        path: path of the local copy
+        info: ObjectInfo of the object in the store
+        Returns True if the local copy has the size and checksum of the object.
+        The checksum of the local copy is stored next to it, so that the file is only hashed
+        again if it changed locally.
+        """
+        if not os.path.isfile(path) or os.path.getsize(path) != info.size:
+            return False
+        if info.md5 is None:
+            return True
+        return self._local_md5(path) == info.md5
+
+    def _local_md5(self, path):
+        """
+        path: path of a local copy
+        Returns the md5 checksum of the local copy.
+        """
+        stat = os.stat(path)
+        checksum_path = path + ".md5"
+        try:
+            with open(checksum_path) as f:
+                checksum = json.load(f)
+            if checksum["size"] == stat.st_size and checksum["mtime_ns"] == stat.st_mtime_ns:
+                return checksum["md5"]
+        except (OSError, ValueError, KeyError):
+            pass
+        md5 = md5_of_file(path)
+        self._write_checksum(path, md5)
+        return md5
+
+    def _write_checksum(self, path, md5):
+        """
+        Stores the checksum of a local copy next to it, with its size and modification time.
+        """
+        stat = os.stat(path)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), 
+                                        prefix=os.path.basename(path) + ".", suffix=".md5.tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "md5": md5}, f)
+            os.replace(tmp_path, path + ".md5")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _download(self, info, path):
+        """
+        info: ObjectInfo of the object to download
+        path: path of the local copy
+        Downloads the object in chunks to a temporary file (with a unique name), validates its 
+        size and checksum and then replaces the local copy, so that a partial download is never
+        used.
+        Raises an IOError if the downloaded file does not match the object.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=os.path.basename(path) + ".", 
+                                        suffix=".download")
+        md5 = hashlib.md5()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as f, self.store.open(info.name) as source:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                    md5.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            md5 = base64.b64encode(md5.digest()).decode()
+            if size != info.size or (info.md5 is not None and md5 != info.md5):
+                raise IOError(f"Checksum mismatch when downloading {info.name}.")
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._write_checksum(path, md5)
+
+#endregion
+
+#region OBJECT STORES
+
+class GCSObjectStore:
+    """
+    Google Cloud Storage bucket.
+    """
+
+    def __init__(self, bucket_name):
+        """
+        bucket_name: name of the bucket (string)
+        """
+        from google.cloud import storage
+        self.client = storage.Client()
+        self.bucket = self.client.bucket(bucket_name)
+
+    def list_objects(self):
+        """
+        Returns the ObjectInfo of all objects in the bucket.
+        """
+        return [ObjectInfo(b.name, b.size, b.md5_hash) for b in self.client.list_blobs(self.bucket)]
+
+    def get_object(self, name):
+        """
+        name: name of the object (string)
+        Returns the ObjectInfo of the object, or None if it does not exist.
+        """
+        blob = self.bucket.get_blob(name)
+        if blob is None:
+            return None
+        return ObjectInfo(blob.name, blob.size, blob.md5_hash)
+
+    def open(self, name):
+        """
+        name: name of the object (string)
+        Returns a binary file object that streams the content of the object.
+        """
+        return self.bucket.blob(name).open("rb", chunk_size=CHUNK_SIZE)
+
+
+class FilesystemObjectStore:
+    """
+    A local directory that behaves like a bucket: every file in the directory is an object.
+    """
+
+    def __init__(self, path):
+        """
+        path: the directory containing the objects (string)
+        """
+        self.path = path
+        # checksums of the files by name, size and modification time
+        self.checksums = {}
+
+    def list_objects(self):
+        """
+        Returns the ObjectInfo of all objects in the directory.
+        """
+        objects = []
+        for name in sorted(os.listdir(self.path)):
+            info = self.get_object(name)
+            if info is not None:
+                objects.append(info)
+        return objects
+
+    def get_object(self, name):
+        """
+        name: name of the object (string)
+        Returns the ObjectInfo of the object, or None if it does not exist.
+        """
+        path = os.path.join(self.path, name)
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        key = (name, stat.st_size, stat.st_mtime_ns)
+        if key not in self.checksums:
+            self.checksums[key] = md5_of_file(path)
+        return ObjectInfo(name, stat.st_size, self.checksums[key])
+
+    def open(self, name):
+        """
+        name: name of the object (string)
+        Returns a binary file object with the content of the object.
+        """
+        return open(os.path.join(self.path, name), "rb")
+
+#endregion
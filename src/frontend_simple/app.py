@@ -1,11 +1,25 @@
 from flask import Flask, request, redirect, url_for, render_template, jsonify
-from helper_code.hospital_data import HospitalData
+import helper_code.hospital_data as hd
 import helper_code.data_loader as dl
 # import helper_code.chatbot as chatbot
 from termcolor import colored
+import os
 
 app = Flask(__name__)
 
+# Reload the state files that changed on disk every DATA_RELOAD_INTERVAL seconds (off if not set)
+if os.environ.get("DATA_RELOAD_INTERVAL"):
+    dl.start_auto_reload(float(os.environ["DATA_RELOAD_INTERVAL"]))
+# Evict the least recently used states above STATE_MEMORY_BUDGET_MB megabytes (no limit if not set)
+if os.environ.get("STATE_MEMORY_BUDGET_MB"):
+    dl.STATE_MEMORY_BUDGET = int(float(os.environ["STATE_MEMORY_BUDGET_MB"]) * 1e6)
+# Number of preprocessed hospitals kept in memory (see hospital_data.get_hospital_data())
+if os.environ.get("HOSPITAL_DATA_CACHE_SIZE"):
+    hd.HOSPITAL_DATA_CACHE_SIZE = int(os.environ["HOSPITAL_DATA_CACHE_SIZE"])
+# Parse all state files in parallel at startup if PRELOAD_STATES is set (see /ready)
+if os.environ.get("PRELOAD_STATES"):
+    dl.start_preload()
+
 SELECT_STATE_PAGE = "state_selection.html"
 SELECT_HOSPITAL_PAGE = "hospital_selection.html"
 DASHBOARD_HOME_PAGE = "home.html"
@@ -22,6 +36,13 @@ def index():
         print(colored("No warnings found in the data loading process", 'green'))
     return render_template(SELECT_STATE_PAGE, states=dl.get_formatted_states_list())
 
+@app.route('/ready')
+def ready():
+    # the app is ready once all states are preloaded (immediately if preloading is off)
+    if dl.PRELOAD_READY.is_set():
+        return jsonify({"ready": True})
+    return jsonify({"ready": False}), 503
+
 #region HOSPITAL AND STATE SELECTION
 
 @app.route('/<state>/')
@@ -51,7 +72,7 @@ def dashboard_home(state, hospital):
         print("Invalid hospital: ", hospital)
         return redirect(url_for('select_hospital', state=state))
     
-    hospital_data = HospitalData(state, hospital)
+    hospital_data = hd.get_hospital_data(state, hospital)
     errors = hospital_data.get_errors()
     if len(errors) > 0:
         for error in errors:
@@ -0,0 +1,17 @@
+"""
+Benchmarks of the loading and preprocessing of the survey data, run on synthetic data.
+The benchmarks use the modules in helper_code and are run from the frontend_simple directory,
+e.g. "python -m benchmarks.state_cache --rows 200000". Each one prints its timings and checks
+that the compared implementations give the same result.
+
+- synthetic_data: generates synthetic surveys and writes them as .xlsx files
+- state_cache: parsing a state workbook vs loading it from the Parquet cache
+- hospital_partitions: hospital frames taken from the row partitions vs a mask over the state
+- workbook_ingest: checks of the streamed workbooks against pd.read_excel and their peak memory
+- standardize_answers: standardization of the answers of a wide survey
+- anonymize_answers: k-anonymity of a textual question with many rare answers
+- anonymize_numerical: ranges of the numerical answers compared with the original code
+- censor_feedback: censoring of the open feedback per text vs in batches
+- word_counts: word counts of the open feedback as the vocabulary grows
+
+"""
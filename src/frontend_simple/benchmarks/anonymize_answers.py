@@ -0,0 +1,82 @@
+"""
+Benchmark of the k-anonymity of the textual answers (see
+HospitalData._anonymize_textual_question()).
+
+The answers to a question with many distinct values (--common values that occur often,
+--rare free-text values that occur less than MIN_K times, null values and "Prefer not to
+answer") are anonymized with the loop of the original code, which replaced each rare value
+with "Other" in its own masked assignment, and with the current code. The results are checked
+to be identical.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+import helper_code.hospital_data as hd
+
+
+def make_answers(n_rows, n_common, n_rare, seed=0):
+    """
+    Returns a dataframe with n_rows answers to the question "Q": n_rare values occurring 3 times,
+    600 null values and "Prefer not to answer", the other answers are n_common common values.
+    """
+    rng = np.random.default_rng(seed)
+    common = [f"Race {i}" for i in range(n_common)]
+    rare = [f"Free text {i}" for i in range(n_rare)]
+    answers = list(rng.choice(common, n_rows - 3 * n_rare - 600))
+    answers += [answer for answer in rare for _ in range(3)]
+    answers += ["Prefer not to answer"] * 2 + [None] * 598
+    rng.shuffle(answers)
+    return pd.DataFrame({"Q": pd.Series(answers, dtype=object)})
+
+
+def anonymize_previous(df, question_id):
+    """
+    The loop of the original HospitalData._anonymize_textual_question().
+    """
+    value_counts = df[question_id].value_counts()
+    keys = value_counts.keys().tolist()
+    for key in keys:
+        if pd.isna(key):
+            continue
+        if key == "Prefer not to answer":
+            continue
+        if value_counts[key] < hd.MIN_K:
+            df.loc[df[question_id] == key, question_id] = "Other"
+
+
+def anonymize_current(df, question_id):
+    """
+    The current HospitalData._anonymize_textual_question().
+    """
+    data = hd.HospitalData.__new__(hd.HospitalData)
+    data.df = df
+    data._anonymize_textual_question(question_id)
+
+
+def main(n_rows, n_common, n_rare):
+    df = make_answers(n_rows, n_common, n_rare)
+    print(f"{n_rows} answers, {df['Q'].nunique()} distinct values ({n_rare} rare)")
+    results = []
+    for name, anonymize in [("previous", anonymize_previous), ("current", anonymize_current)]:
+        result = df.copy()
+        start = time.perf_counter()
+        anonymize(result, "Q")
+        print(f"{name:>8}: {(time.perf_counter() - start) * 1000:.1f} ms")
+        results.append(result)
+    assert_frame_equal(results[0], results[1])
+    print("The anonymized answers are identical")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--rows', default=20000, type=int, help='Number of answers')
+    parser.add_argument('-c', '--common', default=40, type=int, help='Number of common values')
+    parser.add_argument('--rare', default=960, type=int, help='Number of rare values')
+    args = parser.parse_args()
+
+    main(args.rows, args.common, args.rare)
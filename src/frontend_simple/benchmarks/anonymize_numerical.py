@@ -0,0 +1,169 @@
+"""
+Benchmark of the k-anonymity of the numerical answers (see
+HospitalData._anonymize_numerical_question() and _choose_numerical_ranges()).
+
+A corpus of --columns generated numerical questions (ages, small and wide integer ranges,
+fractional, negative and skewed values, columns with null values, from 1 to 3000 answers) is
+anonymized with the original code, which grew the range size in a loop scanning the column for
+each bucket and replaced each answer with a lambda, and with the current code. The answer lists
+and the replaced answers of each column are checked to be identical.
+The original and current code are then timed on an age-like question and on durations from 0
+to 3000 with --rows answers each.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import helper_code.hospital_data as hd
+
+KINDS = ["age", "small", "wide", "float", "negative", "null", "int", "skewed"]
+
+
+def make_answers(kind, n_rows, rng):
+    """
+    Returns a dataframe with n_rows answers of the given kind to the numerical question "Q".
+    """
+    if kind == "age":
+        values = rng.normal(30, 6, n_rows).round()
+    elif kind == "small":
+        values = rng.integers(0, 5, n_rows).astype(float)
+    elif kind == "wide":
+        values = rng.integers(0, 3000, n_rows).astype(float)
+    elif kind == "float":
+        values = rng.uniform(0, 60, n_rows)
+    elif kind == "negative":
+        values = rng.integers(-20, 40, n_rows).astype(float)
+    elif kind == "int":
+        values = rng.integers(0, 120, n_rows)
+    elif kind == "skewed":
+        values = np.floor(rng.exponential(8, n_rows))
+    else:
+        values = rng.integers(0, 50, n_rows).astype(float)
+        values[rng.random(n_rows) < 0.3] = np.nan
+    return pd.DataFrame({"Q": values})
+
+
+def anonymize_previous(df, column):
+    """
+    The original HospitalData._anonymize_numerical_question().
+    Returns the answer list and the replaced answers.
+    """
+    max_value = int(df[column].max()) + 1
+    last_value = max_value + 1
+    min_range = 1
+
+    chosen_range = False
+    while not chosen_range:
+        chosen_range = True
+        # check that every bucket has at least MIN_K values
+        for i in range(0, max_value, min_range):
+            remaining_values = len(df[df[column] >= i])
+            if i > 0 and remaining_values < hd.MIN_K*2 and remaining_values > hd.MIN_K:
+                last_value = i
+                break
+
+            count = len(
+                df[(df[column] >= i) & (df[column] < i + min_range)]
+                )
+            if count < hd.MIN_K and count != 0:
+                increase = 10 ** (len(str(min_range)) - 1)
+                min_range += increase
+                chosen_range = False
+                break
+        if min_range >= max_value:
+            break
+
+    answer_list = []
+    for i in range(0, last_value, min_range):
+        answer_list.append(f"{i}-{i+min_range}")
+    if last_value < max_value:
+        answer_list.append(f"{last_value}+")
+    answer_list.append("Prefer not to answer")
+
+    def replace_numerical_value(value):
+        if np.isnan(value):
+            return "Prefer not to answer"
+        if value >= last_value:
+            return f"{last_value}+"
+        lower = value - value % min_range
+        upper = lower + min_range
+        return f"{int(lower)}-{int(upper)}"
+
+    return answer_list, df[column].apply(replace_numerical_value)
+
+
+class AnswerLists:
+    """
+    Records the answer lists set by HospitalData (in place of its Configuration).
+    """
+
+    def __init__(self):
+        self.answer_lists = {}
+
+    def set_answer_list(self, id, answer_list):
+        self.answer_lists[id] = answer_list
+
+
+def anonymize_current(df, column):
+    """
+    The current HospitalData._anonymize_numerical_question().
+    Returns the answer list and the replaced answers.
+    """
+    data = hd.HospitalData.__new__(hd.HospitalData)
+    data.df = df.copy()
+    data.config = AnswerLists()
+    data._anonymize_numerical_question(column)
+    return data.config.answer_lists[column], data.df[column]
+
+
+def check_corpus(n_columns, seed=0):
+    """
+    Checks that the original and current code give the same answer lists and answers on
+    n_columns generated questions. Returns the total time of each.
+    """
+    rng = np.random.default_rng(seed)
+    seconds = {"previous": 0, "current": 0}
+    checked = 0
+    for _ in range(n_columns):
+        kind = KINDS[rng.integers(len(KINDS))]
+        n_rows = int(rng.choice([1, 3, 8, 12, 30, 100, 500, 3000]))
+        df = make_answers(kind, n_rows, rng)
+        if df["Q"].isna().all():
+            continue
+        results = {}
+        for name, anonymize in [("previous", anonymize_previous), ("current", anonymize_current)]:
+            start = time.perf_counter()
+            answer_list, answers = anonymize(df, "Q")
+            seconds[name] += time.perf_counter() - start
+            results[name] = (answer_list, answers.tolist())
+        assert results["previous"] == results["current"], \
+            f"different buckets for a column of kind {kind} with {n_rows} answers"
+        checked += 1
+    print(f"{checked} columns: the answer lists and answers are identical "
+          f"(previous {seconds['previous']:.2f} s, current {seconds['current']:.2f} s)")
+
+
+def main(n_columns, n_rows):
+    check_corpus(n_columns)
+    rng = np.random.default_rng(1)
+    for kind in ["age", "wide"]:
+        df = make_answers(kind, n_rows, rng)
+        line = f"{n_rows} answers ({kind}):"
+        for name, anonymize in [("previous", anonymize_previous), ("current", anonymize_current)]:
+            start = time.perf_counter()
+            anonymize(df, "Q")
+            line += f" {name} {time.perf_counter() - start:.2f} s"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--columns', default=800, type=int, help='Number of checked questions')
+    parser.add_argument('-r', '--rows', default=200000, type=int,
+                        help='Number of answers of the timed questions')
+    args = parser.parse_args()
+
+    main(args.columns, args.rows)
@@ -0,0 +1,87 @@
+"""
+Benchmark of the censoring of the open feedback (see PreprocessedState.censor_texts()).
+
+--texts distinct synthetic feedback texts (with names, places and numbers) are censored with the
+code of the original HospitalData._censor_entities(), which ran the whole spaCy pipeline on
+each text, and with the current code, which streams the texts through nlp.pipe in batches with
+only the components needed to recognize the entities. The persistent cache of the censored
+texts is in a new temporary directory, so that all texts are censored. The censored texts are
+checked to be identical.
+"""
+
+import argparse
+import random
+import re
+import tempfile
+import time
+
+import helper_code.data_loader as dl
+import helper_code.hospital_data as hd
+from benchmarks.synthetic_data import WORDS
+
+ENTITIES = ["John", "Mary", "Dr. Smith", "Seattle", "Boston", "3", "(Mary)", "'ok'"]
+
+
+def make_texts(n_texts, seed=0):
+    """
+    Returns n_texts distinct feedback texts.
+    """
+    rng = random.Random(seed)
+    texts = set()
+    while len(texts) < n_texts:
+        words = [rng.choice(WORDS + ENTITIES + ["!", ".", ","]) for _ in range(rng.randint(3, 40))]
+        texts.add(" ".join(words))
+    return sorted(texts)
+
+
+def censor_previous(text):
+    """
+    The original HospitalData._censor_entities().
+    """
+    doc = hd.nlp(text)
+    censored_text = ' '.join(['_' if token.ent_type_ else token.text for token in doc])
+    censored_text = re.sub(r'\s([.,?!:;)\]}\'"])', r'\1', censored_text)
+    censored_text = re.sub(r'([(\[{\'"]) ', r'\1', censored_text)
+    return censored_text
+
+
+def censor_current(texts):
+    """
+    The censoring of the current PreprocessedState.
+    """
+    state = hd.PreprocessedState.__new__(hd.PreprocessedState)
+    state.censored = {}
+    state.censor_texts(texts)
+    return [state.censor(text) for text in texts]
+
+
+def main(n_texts, n_process):
+    texts = make_texts(n_texts)
+    print(f"{n_texts} texts, pipeline: {hd.nlp.pipe_names}, disabled: {hd._get_unused_pipes()}")
+
+    start = time.perf_counter()
+    previous = [censor_previous(text) for text in texts]
+    seconds = time.perf_counter() - start
+    print(f"previous (per text): {n_texts / seconds:.0f} texts/s")
+
+    for processes in sorted({1, n_process}):
+        hd.CENSOR_N_PROCESS = processes
+        with tempfile.TemporaryDirectory() as directory:
+            dl.CACHE_PATH = directory
+            start = time.perf_counter()
+            current = censor_current(texts)
+            seconds = time.perf_counter() - start
+        print(f"current (batches, n_process={processes}): {n_texts / seconds:.0f} texts/s")
+        assert current == previous, "the censored texts are different"
+    print(f"The censored texts are identical ({sum(a != b for a, b in zip(texts, previous))} "
+          f"texts changed by censoring)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-t', '--texts', default=5000, type=int, help='Number of texts')
+    parser.add_argument('-p', '--n_process', default=1, type=int,
+                        help='Number of processes of the current code (1 is always measured)')
+    args = parser.parse_args()
+
+    main(args.texts, args.n_process)
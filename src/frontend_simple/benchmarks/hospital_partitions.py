@@ -0,0 +1,98 @@
+"""
+Benchmark of the hospital frames taken from the row partitions of the state (see
+data_loader.take_hospital_rows() and _build_partitions()).
+
+A synthetic state with --rows surveys is built in memory with the compact data types of the
+data_loader module (the .xlsx file is not written, see state_cache for the parsing), then the
+frame of each hospital is selected --repeat times:
+- as the original get_hospital_df(), with a boolean mask over the whole state and a copy
+- as the current code, taking the rows of the hospital from the partitions built at load time
+The time and the peak memory allocated per request (measured with tracemalloc) are printed,
+with the memory of the partitions, which is allocated once per state. The frames of each
+hospital are checked to be identical.
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+import helper_code.data_loader as dl
+from benchmarks.synthetic_data import make_surveys
+
+
+def make_state(n_rows):
+    """
+    Returns the dataframe (with compact data types) and the configuration of a synthetic state
+    with n_rows surveys, as the data_loader module stores them.
+    """
+    columns, rows = make_surveys(n_rows)
+    df = pd.DataFrame(rows, columns=pd.MultiIndex.from_tuples(columns))
+    config = pd.DataFrame(df.columns.tolist(), columns=["ID", "Text", "Category"])
+    df.columns = df.columns.droplevel([1, 2])
+    df, _ = dl._compact_frame(df, config)
+    return df, config
+
+
+def select_previous(df, partitions, hospital):
+    """
+    The selection of the original get_hospital_df().
+    """
+    hospital_df = df[df["site_name"] == hospital]
+    hospital_df.reset_index(drop=True, inplace=True)
+    return hospital_df
+
+
+def select_current(df, partitions, hospital):
+    """
+    The selection of the current take_hospital_rows().
+    """
+    hospital_df = df.take(partitions[hospital])
+    hospital_df.reset_index(drop=True, inplace=True)
+    return hospital_df
+
+
+def measure(select, df, partitions, hospital, repeat):
+    """
+    Returns the frame of the hospital, the mean time of a selection in seconds and the peak
+    memory allocated by a selection in bytes.
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        select(df, partitions, hospital)
+    seconds = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    hospital_df = select(df, partitions, hospital)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return hospital_df, seconds, peak
+
+
+def main(n_rows, repeat):
+    df, _ = make_state(n_rows)
+    partitions = dl._build_partitions(df)
+    print(f"{n_rows} surveys, {df.memory_usage(deep=True).sum() / 1e6:.1f} MB frame, "
+          f"partitions {sum(rows.nbytes for rows in partitions.values()) / 1e6:.2f} MB "
+          f"(once per state)")
+    for hospital, rows in partitions.items():
+        frames = []
+        line = f"{hospital:>25} ({len(rows):>6} rows):"
+        for name, select in [("previous", select_previous), ("current", select_current)]:
+            hospital_df, seconds, peak = measure(select, df, partitions, hospital, repeat)
+            line += f" {name} {seconds * 1000:.1f} ms, peak +{peak / 1e6:.1f} MB;"
+            frames.append(hospital_df)
+        print(line)
+        assert_frame_equal(frames[0], frames[1])
+    print("The frames of the hospitals are identical")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--rows', default=200000, type=int, help='Number of surveys')
+    parser.add_argument('--repeat', default=10, type=int,
+                        help='Number of selections timed for each hospital')
+    args = parser.parse_args()
+
+    main(args.rows, args.repeat)
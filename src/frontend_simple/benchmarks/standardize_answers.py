@@ -0,0 +1,99 @@
+"""
+Benchmark of the standardization of the answers (see PreprocessedState._standardize_answers()
+and the end of HospitalData.preprocess()).
+
+A wide synthetic survey (--rows rows, --questions text questions with "Prefers not to answer",
+"other" and null answers, 10 numerical columns with null values and a date column) is
+standardized with the loops of the original preprocess() and with the current code:
+- "Prefers not to answer" is replaced with "Prefer not to answer" and "other" with "Other"
+- the numerical columns are converted to strings
+- the null values are replaced with "Prefer not to answer"
+The results are checked to be identical, including the data types of the columns.
+"""
+
+import argparse
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+import helper_code.hospital_data as hd
+
+ANSWERS = np.array(["Strongly agree", "Agree", "Disagree", "other", "Prefers not to answer", None],
+                   dtype=object)
+
+
+def make_survey(n_rows, n_questions, seed=0):
+    """
+    Returns a dataframe with n_rows answers to n_questions text questions, 10 numerical
+    questions and a date column.
+    """
+    rng = np.random.default_rng(seed)
+    columns = {f"Q{i}": rng.choice(ANSWERS, n_rows) for i in range(n_questions)}
+    for i in range(10):
+        values = rng.integers(0, 40, n_rows).astype(float)
+        values[::17] = np.nan
+        columns[f"N{i}"] = values
+    columns["StartDate"] = (pd.Timestamp("2024-01-01")
+                            + pd.to_timedelta(rng.integers(0, 300, n_rows), unit="D"))
+    return pd.DataFrame(columns)
+
+
+def standardize_previous(df):
+    """
+    The standardization steps of the original HospitalData.preprocess().
+    """
+    df = df.copy()
+    for c in df.columns:
+        to_change_df = df[df[c] == "Prefers not to answer"]
+        if not to_change_df.empty:
+            df.loc[df[c] == "Prefers not to answer", c] = "Prefer not to answer"
+    for c in df.columns:
+        to_change_df = df[df[c] == "other"]
+        if not to_change_df.empty:
+            df.loc[df[c] == "other", c] = "Other"
+    for c in df.columns:
+        if df[c].dtype == float or df[c].dtype == int:
+            df[c] = df[c].astype(str)
+        df[c] = df[c].fillna(hd.NULL_ANSWER)
+    return df
+
+
+def standardize_current(df):
+    """
+    The standardization steps of PreprocessedState and HospitalData.preprocess().
+    """
+    state = hd.PreprocessedState.__new__(hd.PreprocessedState)
+    state.df = df.copy()
+    state.date_column = "StartDate"
+    state._standardize_answers()
+    df = state.df
+    numerical = df.columns[df.dtypes.isin([np.dtype(float), np.dtype(int)])]
+    if len(numerical) > 0:
+        df[numerical] = df[numerical].astype(str)
+    return df.fillna(hd.NULL_ANSWER)
+
+
+def main(n_rows, n_questions):
+    df = make_survey(n_rows, n_questions)
+    print(f"{n_rows} rows, {n_questions} text questions, 10 numerical questions and a date column")
+    results = []
+    for name, standardize in [("previous", standardize_previous), ("current", standardize_current)]:
+        start = time.perf_counter()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always", FutureWarning)
+            results.append(standardize(df))
+        print(f"{name:>8}: {time.perf_counter() - start:.2f} s, {len(caught)} FutureWarnings")
+    assert_frame_equal(results[0], results[1])
+    print("The standardized frames are identical")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--rows', default=20000, type=int, help='Number of surveys')
+    parser.add_argument('-q', '--questions', default=150, type=int, help='Number of text questions')
+    args = parser.parse_args()
+
+    main(args.rows, args.questions)
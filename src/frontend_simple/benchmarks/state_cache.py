@@ -0,0 +1,75 @@
+"""
+Benchmark of the cache of the parsed state files (see the COLUMNAR CACHE region of data_loader).
+
+A synthetic state with --rows surveys is written to an .xlsx file, then:
+- the file is parsed (as on the first load of the state) and the cache is written
+- the state is loaded from the cache --repeat times
+- the modification time of the file is changed and the state is loaded from the cache again,
+which checks the content hash of the file
+
+The frame and the configuration loaded from the cache are checked to be identical to the parsed
+ones. Requires pyarrow.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from pandas.testing import assert_frame_equal
+
+import helper_code.data_loader as dl
+from benchmarks.synthetic_data import make_surveys, write_workbook
+
+
+def timed(function, *args):
+    """
+    Returns the result of function(*args) and the time it took in seconds.
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main(n_rows, directory, repeat):
+    path = os.path.join(directory, "WA.xlsx")
+    if not os.path.isfile(path):
+        columns, rows = make_surveys(n_rows)
+        _, seconds = timed(write_workbook, path, columns, rows)
+        print(f"Wrote {n_rows} surveys to {path} in {seconds:.1f} s")
+    dl.CACHE_PATH = os.path.join(directory, "cache")
+
+    (df, config), seconds = timed(dl._read_workbook, path)
+    print(f"Parse .xlsx file:             {seconds:.2f} s")
+    df, memory = dl._compact_frame(df, config)
+    _, seconds = timed(dl._write_cache, "WA", path, df, config, memory)
+    print(f"Write cache:                  {seconds:.2f} s "
+          f"({os.path.getsize(dl._cache_paths('WA')[0]) / 1e6:.1f} MB Parquet file, "
+          f"{os.path.getsize(path) / 1e6:.1f} MB .xlsx file)")
+
+    for _ in range(repeat):
+        cached, seconds = timed(dl._read_cache, "WA", path)
+        print(f"Load from cache:              {seconds:.2f} s")
+    os.utime(path)
+    cached, seconds = timed(dl._read_cache, "WA", path)
+    print(f"Load from cache after touch:  {seconds:.2f} s")
+
+    assert_frame_equal(cached[0], df)
+    assert_frame_equal(cached[1], config)
+    print("The cached frame and configuration are identical to the parsed ones")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--rows', default=200000, type=int, help='Number of surveys')
+    parser.add_argument('-d', '--dir', default=None, type=str,
+                        help='Directory of the .xlsx file and of the cache (reused if the file exists)')
+    parser.add_argument('--repeat', default=3, type=int, help='Number of loads from the cache')
+    args = parser.parse_args()
+
+    if args.dir is None:
+        with tempfile.TemporaryDirectory() as directory:
+            main(args.rows, directory, args.repeat)
+    else:
+        os.makedirs(args.dir, exist_ok=True)
+        main(args.rows, args.dir, args.repeat)
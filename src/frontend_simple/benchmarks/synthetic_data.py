@@ -0,0 +1,87 @@
+"""
+This file contains functions to generate synthetic surveys for the benchmarks, in the format of
+the state files (see README.md): three header rows with the question IDs, texts and categories,
+then one row per survey.
+
+The surveys have the columns of a real export (dates, response id, hospital, trust and
+experience questions, demographics, open feedback, ...), including a duplicated question ID,
+mixed-type columns and missing values. The values are drawn from a seeded generator, so the
+same arguments always give the same surveys.
+"""
+
+import datetime
+import random
+
+LIKERT = ["Strongly Agree", "Agree", "Somewhat Agree", "Somewhat Disagree", "Disagree",
+          "Strongly Disagree", "Prefer Not to Answer"]
+SITES = ["Providence St. Peter", "MultiCare Good Samaritan", "Swedish First Hill", "Overlake",
+         "Tiny Clinic"]
+WORDS = ("the nurse was very kind and caring nurses helped me doctor doctors listened listening "
+         "great care staff room food pain").split()
+# Columns of the surveys: (question ID, question text, category)
+COLUMNS = [("StartDate", "Start Date", "date"), ("EndDate", "End Date", "info"),
+           ("ResponseId", "Response ID", "info"), ("site_name", "Site", "site_name"),
+           ("Q1", "My clinical team asked me how involved I wanted to be.", "trust"),
+           ("Q2", "My care team held a huddle with me.", "hospital_xp"),
+           ("Q3", "Did you participate in a huddle?", "huddle"), ("Q4", "Age", "age"),
+           ("Q5", "Race", "race"), ("Q5_7_TEXT", "Race - Other - Text", "race"),
+           ("Q6", "Education", "education"), ("Q7", "Insurance", "insurance"),
+           ("Q8", "Income", "demographics"), ("Q8_TEXT", "Income - Text", "demographics"),
+           ("Q9", "I felt respected.", "trust"), ("Q9", "I felt listened to.", "trust"),
+           ("Q10", "Hours in labor", "hospital_xp"),
+           ("Q23", "Is there anything else you want to share?", "open_feedback"),
+           ("Q24", "Other feedback", "open_feedback"), ("Q30", "Unused", "info"),
+           ("Q31", "Who should decide?", "preference")]
+
+
+def make_surveys(n_rows, seed=0):
+    """
+    n_rows: number of surveys (int)
+    seed: seed of the random generator (int)
+    Returns the columns (list of (question ID, question text, category)) and the rows (list of
+    lists of values) of n_rows synthetic surveys.
+    """
+    rng = random.Random(seed)
+    start = datetime.datetime(2022, 3, 5)
+    rows = []
+    for i in range(n_rows):
+        date = start + datetime.timedelta(days=rng.randint(0, 700), hours=rng.randint(0, 23))
+        feedback = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+        feedback += rng.choice([". John was great!", " in Seattle, 3 days.", " (Mary) said 'ok'",
+                                "", "!"])
+        rows.append([
+            date, date + datetime.timedelta(minutes=5), f"R_{i}",
+            # a few hospitals have most of the surveys, a few surveys have no hospital
+            SITES[min(rng.randint(0, 4), rng.randint(0, 4))] if rng.random() > 0.01 else None,
+            rng.choice(LIKERT + [None]), rng.choice(LIKERT + ["Prefers not to answer"]),
+            rng.choice(["Yes", "No", "Not sure", None]),
+            rng.choice([rng.randint(16, 45), rng.randint(16, 45), None, rng.randint(46, 60)]),
+            rng.choice(["White", "Black", "Asian", "Hispanic", "other", "Pacific Islander", None]),
+            rng.choice([None, None, None, f"race{rng.randint(0, 30)}"]),
+            rng.choice(["High school", "College", "Graduate", "Prefers not to answer"]),
+            rng.choice(["Private", "Medicaid", "Other", None, "other"]),
+            rng.choice(["<25k", "25-50k", "50-100k", ">100k", "Prefer not to answer"]),
+            rng.choice([None, "lots"]),
+            rng.choice(LIKERT), rng.choice(LIKERT),
+            rng.choice([rng.randint(1, 30), None, rng.randint(1, 200)]),
+            rng.choice([None, feedback]),
+            rng.choice([None, None, "Dr. Smith " + " ".join(rng.choice(WORDS) for _ in range(5))]),
+            rng.choice(["a", "b"]), rng.choice(["x", "y", "z"])])
+    return COLUMNS, rows
+
+
+def write_workbook(path, columns, rows):
+    """
+    path: path of the .xlsx file to write
+    columns: list of (question ID, question text, category)
+    rows: list of lists of values
+    Writes the surveys to an .xlsx file with the three header rows.
+    """
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for level in range(3):
+        sheet.append([column[level] for column in columns])
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
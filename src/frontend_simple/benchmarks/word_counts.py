@@ -0,0 +1,136 @@
+"""
+Benchmark of the word counts of the open feedback (see HospitalData.get_word_counts()).
+
+Synthetic corpora of preprocessed feedback, with a vocabulary that grows with the number of
+feedbacks (common words and rare made-up words), are counted with the code of the original
+get_word_counts(), which compared the stems of all pairs of words and searched each stem in
+every feedback, and with the current code, which counts the stems in one pass. The original
+code is only run up to --previous_max feedbacks, as its time grows quadratically.
+
+The stems counted are checked to be the same. The original code counted a stem in a feedback
+if it appeared inside any word (e.g. "car" in "care"), the current code only counts whole words,
+so the current counts are checked to be at most the original ones.
+
+The preprocessing of the feedback for the word counts (see _preprocess_for_word_count()) is
+also timed, with the stopwords loaded for every text (as in the original code) and once.
+"""
+
+import argparse
+import random
+import re
+import time
+
+import pandas as pd
+from nltk.corpus import stopwords
+from nltk.stem import SnowballStemmer
+
+import helper_code.hospital_data as hd
+
+COMMON_WORDS = ("nurse nurses nursing care caring cared doctor doctors listen listened listening "
+                "kind staff room food pain help helped helpful great wait waiting waited baby "
+                "birth labor").split()
+
+
+def make_feedback(n_feedbacks, rng):
+    """
+    Returns n_feedbacks preprocessed feedbacks, with a vocabulary growing with n_feedbacks.
+    """
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    vocabulary = COMMON_WORDS + ["".join(rng.choice(letters) for _ in range(rng.randint(4, 9)))
+                                 for _ in range(int(8 * n_feedbacks ** 0.7))]
+    return [" ".join(rng.choice(COMMON_WORDS) if rng.random() < 0.6 else rng.choice(vocabulary)
+                     for _ in range(rng.randint(5, 30))) for _ in range(n_feedbacks)]
+
+
+def word_counts_previous(feedback):
+    """
+    The original HospitalData.get_word_counts() (with the stemmed feedback computed first).
+    """
+    stemmer = SnowballStemmer('english')
+    stemmed_feedback = [' '.join([stemmer.stem(word) for word in f.split()]) for f in feedback]
+    words = set()
+    for f in feedback:
+        words.update(f.split())
+    for w1 in words.copy():
+        for w2 in words.copy():
+            if w1 in words and w2 in words and w1 != w2 and stemmer.stem(w1) == stemmer.stem(w2):
+                words.remove(w2)
+    word_counts = {}
+    for w in words:
+        word_counts[w] = 0
+        stemmed_w = stemmer.stem(w)
+        for f in stemmed_feedback:
+            if stemmed_w in f:
+                word_counts[w] += 1
+    return dict(sorted(word_counts.items(), key=lambda item: item[1], reverse=True))
+
+
+def word_counts_current(feedback):
+    """
+    The current HospitalData.get_word_counts().
+    """
+    data = hd.HospitalData.__new__(hd.HospitalData)
+    data.stemmer = SnowballStemmer('english')
+    data.stems = {}
+    data.word_counts = None
+    data.preprocessed_feedback = pd.DataFrame({"Feedback": feedback})
+    return data.get_word_counts()
+
+
+def check_counts(previous, current):
+    """
+    Checks that the same stems are counted and that no current count is higher.
+    Returns the number of stems with a different count.
+    """
+    stem = SnowballStemmer('english').stem
+    previous = {stem(word): count for word, count in previous.items()}
+    current = {stem(word): count for word, count in current.items()}
+    assert previous.keys() == current.keys(), "the counted stems are different"
+    assert all(current[s] <= previous[s] for s in previous), "a count is higher than before"
+    return sum(previous[s] != current[s] for s in previous)
+
+
+def preprocess_previous(text):
+    """
+    The original HospitalData._preprocess_for_word_count(), loading the stopwords every time.
+    """
+    text = re.sub(r'[^a-z]', ' ', text.lower())
+    stop_words = set(stopwords.words('english'))
+    return ' '.join([word for word in text.split() if word not in stop_words])
+
+
+def main(sizes, previous_max):
+    rng = random.Random(0)
+    for n_feedbacks in sizes:
+        feedback = make_feedback(n_feedbacks, rng)
+        start = time.perf_counter()
+        current = word_counts_current(feedback)
+        line = (f"{n_feedbacks:>6} feedbacks, {len(current):>6} words: "
+                f"current {(time.perf_counter() - start) * 1000:.1f} ms")
+        if n_feedbacks <= previous_max:
+            start = time.perf_counter()
+            previous = word_counts_previous(feedback)
+            line += f", previous {time.perf_counter() - start:.2f} s"
+            line += f" (same stems, {check_counts(previous, current)} counts differ)"
+        print(line)
+
+    texts = ["The nurses were VERY kind, and Dr. _ listened to me!"] * 500
+    data = hd.HospitalData.__new__(hd.HospitalData)
+    for name, preprocess in [("previous", preprocess_previous),
+                             ("current", data._preprocess_for_word_count)]:
+        start = time.perf_counter()
+        results = [preprocess(text) for text in texts]
+        seconds = time.perf_counter() - start
+        print(f"Preprocessing, {name}: {seconds / len(texts) * 1e6:.0f} us per text")
+    assert results == [preprocess_previous(text) for text in texts]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--feedbacks', default=[250, 500, 1000, 2000, 50000], type=int,
+                        nargs="+", help='Numbers of feedbacks')
+    parser.add_argument('--previous_max', default=2000, type=int,
+                        help='Largest number of feedbacks counted with the original code')
+    args = parser.parse_args()
+
+    main(args.feedbacks, args.previous_max)
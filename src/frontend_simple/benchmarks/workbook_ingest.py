@@ -0,0 +1,165 @@
+"""
+Checks and benchmark of the streaming of the state files (see data_loader._read_workbook()).
+
+"check" generates small random workbooks and checks that data_loader._stream_workbook() gives
+the same frame as pd.read_excel(path, header=[0, 1, 2]). The workbooks have integer, float,
+text, boolean, date, blank and mixed columns, Excel error cells (e.g. "#DIV/0!") in numerical
+and text columns, duplicated question IDs, blank rows and blank trailing rows. They are read
+with chunks down to 1 row.
+
+"memory" writes a synthetic state with --rows surveys and measures the time and the peak memory
+(maximum resident set size) of reading it with pd.read_excel (as before) and with
+data_loader._read_workbook(), each in a new process.
+"""
+
+import argparse
+import datetime
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+import helper_code.data_loader as dl
+from benchmarks.synthetic_data import make_surveys, write_workbook
+
+COLUMN_KINDS = ["int", "float", "text", "mixed", "date", "bool", "blank", "sparse_int",
+                "date_text", "error", "text_error"]
+ERRORS = ["#VALUE!", "#DIV/0!", "#REF!", "#N/A", "#NAME?", "#NULL!"]
+
+
+def random_value(rng, kind):
+    """
+    Returns a random value of a column of the given kind (see COLUMN_KINDS).
+    """
+    if kind == "int":
+        return rng.randint(-5, 50)
+    if kind == "float":
+        return rng.random() * 10
+    if kind == "text":
+        return rng.choice(["a", "b", "NA", "", "n/a", " x "])
+    if kind == "mixed":
+        return rng.choice([1, "a", 2.5, "3", True])
+    if kind == "date":
+        return datetime.datetime(2023, rng.randint(1, 12), rng.randint(1, 28), rng.randint(0, 23))
+    if kind == "bool":
+        return rng.choice([True, False])
+    if kind == "blank":
+        return None
+    if kind == "sparse_int":
+        return rng.choice([None, None, 7])
+    if kind == "date_text":
+        return rng.choice(["2023-01-05", "1/2/2023 10:00", "x"])
+    if kind == "error":
+        return rng.choice([rng.randint(0, 9), rng.random()] + ERRORS[:4])
+    if kind == "text_error":
+        return rng.choice(["a", "b"] + ERRORS[4:])
+
+
+def make_random_workbook(path, seed):
+    """
+    Writes a small random workbook with three header rows to path.
+    """
+    from openpyxl import Workbook
+    rng = random.Random(seed)
+    workbook = Workbook()
+    sheet = workbook.active
+    n_columns, n_rows = rng.randint(1, 8), rng.randint(0, 60)
+    kinds = [rng.choice(COLUMN_KINDS) for _ in range(n_columns)]
+    ids = [rng.choice(["Q1", "Q2", "site_name", None, "Q3"]) for _ in range(n_columns)]
+    for r in range(3):
+        for c in range(n_columns):
+            value = ids[c] if r == 0 else rng.choice([None, f"t{c}", "info", "date"])
+            if value is not None:
+                sheet.cell(row=r + 1, column=c + 1, value=value)
+    for r in range(n_rows):
+        if rng.random() < 0.08:
+            continue
+        for c, kind in enumerate(kinds):
+            value = random_value(rng, kind) if rng.random() >= 0.15 else None
+            if value is not None and value != "":
+                sheet.cell(row=r + 4, column=c + 1, value=value)
+    # blank trailing rows
+    for _ in range(rng.randint(0, 3)):
+        sheet.cell(row=n_rows + 4 + rng.randint(0, 4), column=1, value=None)
+    workbook.save(path)
+
+
+def check(n_workbooks, directory):
+    path = os.path.join(directory, "check.xlsx")
+    checked = 0
+    for seed in range(n_workbooks):
+        make_random_workbook(path, seed)
+        dl.INGEST_CHUNK_ROWS = random.Random(seed).choice([1, 2, 3, 7, 10000])
+        try:
+            expected = pd.read_excel(path, header=[0, 1, 2])
+        except ValueError:
+            # e.g. no data rows, the files are not valid state files
+            continue
+        streamed = dl._stream_workbook(path)
+        if streamed is None:
+            # pd.read_excel is used for this file
+            continue
+        assert_frame_equal(streamed, expected, check_column_type=True)
+        checked += 1
+    print(f"The streamed frames of {checked} workbooks are identical to pd.read_excel")
+
+
+def measure(method, path):
+    """
+    Reads the file with the given method in this process and prints the time and the increase
+    of the peak memory.
+    """
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if method == "read_excel":
+        data = pd.read_excel(path, header=[0, 1, 2])
+        df = data.droplevel([1, 2], axis=1).copy()
+        del data
+    else:
+        df, _ = dl._read_workbook(path)
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in kilobytes
+    peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024
+    print(f"{method:>14}: {seconds:.1f} s, peak memory +{peak:.0f} MB "
+          f"({df.memory_usage(deep=True).sum() / 1e6:.0f} MB frame)")
+
+
+def memory(n_rows, directory):
+    path = os.path.join(directory, "WA.xlsx")
+    if not os.path.isfile(path):
+        columns, rows = make_surveys(n_rows)
+        write_workbook(path, columns, rows)
+    for method in ["read_excel", "stream"]:
+        subprocess.run([sys.executable, "-m", "benchmarks.workbook_ingest", "measure",
+                        "--method", method, "--path", path], check=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=["check", "memory", "measure"])
+    parser.add_argument('-n', '--workbooks', default=600, type=int,
+                        help='Number of random workbooks to check')
+    parser.add_argument('-r', '--rows', default=200000, type=int, help='Number of surveys')
+    parser.add_argument('-d', '--dir', default=None, type=str,
+                        help='Directory of the .xlsx files (reused if they exist)')
+    parser.add_argument('--method', default="stream", choices=["read_excel", "stream"])
+    parser.add_argument('--path', default=None, type=str)
+    args = parser.parse_args()
+
+    if args.command == "measure":
+        measure(args.method, args.path)
+    else:
+        run = check if args.command == "check" else memory
+        size = args.workbooks if args.command == "check" else args.rows
+        if args.dir is None:
+            with tempfile.TemporaryDirectory() as directory:
+                run(size, directory)
+        else:
+            os.makedirs(args.dir, exist_ok=True)
+            run(size, args.dir)
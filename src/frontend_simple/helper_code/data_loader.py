@@ -1,8 +1,10 @@
 """
 This file contains utility functions for loading, updating and managing the data and its 
 configuration for each state.
-"TODO" comments indicate where the code needs to be updated with proper data loading for deployment.
-Currently this works for local deployment reading files from a specified directory.
+The files are read through a storage backend (see the storage module): by default from the 
+local directory DATA_PATH, or from an object store bucket if the DATA_BUCKET environment variable
+is set, in which case the files are downloaded to DOWNLOAD_PATH and only downloaded again when 
+they change in the bucket.
 
 This file contains functions to:
 - load and update data
@@ -12,6 +14,12 @@ This file contains functions to:
 - format hospitals with names and urls
 - separate the data from the configuration in the loaded files
 - return warnings for the user if there are any issues with the data files
+- cache the parsed files in a columnar format (see the COLUMNAR CACHE region)
+- reload the states whose files changed on disk (see the RELOADING region)
+- keep a catalog of the files in the data directory (see the DATA DIRECTORY region)
+- preload all states in parallel at startup (see the PRELOADING region)
+- store the dataframes with compact data types (see the COMPACT DATA TYPES region)
+- keep the loaded states within a memory budget (see the MEMORY BUDGET region)
 
 The "url" of a hospital is the lowercase name with no spaces and no non-alphanumeric characters.
 E.g. "All Hospitals" -> "allhospitals", "Providence St. Peter" -> "providencestpeter".
@@ -24,19 +32,63 @@ dropped.
 
 Both data and configuration are managed as pandas dataframes.
 
+Parsing the .xlsx files is slow, so after the first load the data of each state is written to 
+CACHE_PATH as a Parquet file, with a JSON sidecar holding the configuration. The cache is keyed 
+by the size, modification time and content hash of the .xlsx file, so later loads (also in new 
+processes) read the Parquet file instead of parsing the workbook again. If pyarrow is not 
+installed, the cache is disabled and the workbooks are always parsed.
+
+To reduce memory usage, the dataframes are stored with compact data types: low-cardinality text
+columns as categoricals, numerical columns with the narrowest lossless data type and the date 
+columns as datetime64. The memory usage of each state before and after this step is printed
+when the state is loaded and returned by get_memory_usage(). Code that modifies the dataframes
+should restore the standard data types first (see restore_dtypes()).
+
+Loaded states are not reloaded automatically. reload_changed_states() compares the size and
+modification time of the loaded files with the files on disk and rebuilds the changed states
+(in background threads by default); start_auto_reload() does this periodically. A new state is
+swapped in only once it is completely loaded, and its dataframe and configuration are swapped 
+together. Each state has a data version (get_state_version()) that is increased whenever a 
+different file is loaded, so that caches of derived data can use it as a key.
+
+If STATE_MEMORY_BUDGET is set, the least recently used states are evicted when the memory of 
+the loaded states exceeds it, and are loaded again (usually from the columnar cache) on the next
+request. Eviction only removes the state from the dictionaries of this module, so requests that
+are still using its dataframe are not affected. Other modules can count the memory of the data
+they derived from a state with add_state_memory() and register a function with 
+add_eviction_callback() to drop that data when the state is evicted.
+
 """
 
 import pandas as pd
 import numpy as np
 import re
 import os
-
-# TODO:
-# - Update with proper data loading
+import datetime
+import hashlib
+import json
+import tempfile
+import threading
+import time
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from openpyxl import load_workbook
+from pandas.io.parsers import TextParser
+import helper_code.storage as storage
 
 #region CONSTANTS
 
 DATA_PATH = '/data/'
+DOWNLOAD_PATH = '/tmp/data_download/'
+CACHE_PATH = '/tmp/data_cache/'
+# Minimum number of seconds between two checks of the data storage for changes
+CATALOG_CHECK_INTERVAL = 5
+# Number of data rows parsed at once when reading a workbook
+INGEST_CHUNK_ROWS = 10000
+# Maximum memory in bytes for the data of the loaded states, including the data other modules
+# derived from them (see add_state_memory()) (None: no limit)
+STATE_MEMORY_BUDGET = None
 
 STATE_CODES = {"AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "FL", "GA", "HI", "ID", 
                "IL", "IN", "IA", "KS", "KY", "LA", "ME", "MD", "MA", "MI", "MN", "MS", 
@@ -64,6 +116,17 @@ CODE_STATE_DICT = {"AL": "ALABAMA", "AK": "ALASKA", "AZ": "ARIZONA", "AR": "ARKA
 # Dictionaries to store the dataframes and configurations for each state
 STATE_DF_DICT = {}
 STATE_CONFIG_DICT = {}
+# Hospital catalog for each state: dictionary from hospital url to formatted hospital
+STATE_HOSPITALS_DICT = {}
+# Rows of each hospital for each state: dictionary from hospital name to row positions
+STATE_PARTITIONS_DICT = {}
+# Memory usage in bytes of each state before and after converting to compact data types
+STATE_MEMORY_DICT = {}
+# Data version and (size, modification time) of the loaded file for each state
+STATE_VERSION_DICT = {}
+STATE_FINGERPRINT_DICT = {}
+# Lock for swapping in the data of a state
+_STATE_LOCK = threading.Lock()
 VALID_STATES = set()
 WARNINGS = []
 STATE_WARNINGS = {}
@@ -75,7 +138,7 @@ def get_warnings(state=None):
     Returns a list of warnings for the user.
     """
     if state is None:
-        update_warnings()
+        _refresh_catalog()
         return WARNINGS
     else:
         if state in STATE_WARNINGS:
@@ -83,60 +146,328 @@ def get_warnings(state=None):
         else:
             return []
 
-#TODO: Update this with proper data loading for deployment
 def update_warnings():
     """
-    Updates the warnings:
+    Updates the warnings (and the valid states) by scanning the data directory again.
+    """
+    _refresh_catalog(force=True)
+
+def _file_warnings(filenames):
+    """
+    filenames: names of the files in the data directory
+    Returns the warnings for the files:
     - checks for unrecognised state codes in the data files
     - checks for invalid file extensions in the data files (only .xlsx files are allowed)
     """
-    WARNINGS.clear()
-    filenames = os.listdir(DATA_PATH)
-
+    warnings = []
     for filename in filenames:
         split_filename = filename.split(".")
         if len(split_filename) != 2:
-            WARNINGS.append(f"Invalid file format: {filename}.")
+            warnings.append(f"Invalid file format: {filename}.")
         else:    
             name = filename.split(".")[0]
             extension = filename.split(".")[1]
 
             if name not in STATE_CODES:
-                WARNINGS.append(f"Unrecognised state code in file: {filename}.")
+                warnings.append(f"Unrecognised state code in file: {filename}.")
             if extension != "xlsx":
-                WARNINGS.append(f"Invalid file extension in file: {filename}.")
+                warnings.append(f"Invalid file extension in file: {filename}.")
+    return warnings
+
+#endregion
+
+#region DATA DIRECTORY
+
+# Storage the files are read from (see get_storage())
+STORAGE = None
+# Version of the storage at the last scan and time of the last check
+_CATALOG = {"version": None, "checked_at": None}
+_CATALOG_LOCK = threading.Lock()
+
+def get_storage():
+    """
+    Returns the storage backend the state files are read from, creating it on first use 
+    (see storage.get_storage()).
+    """
+    global STORAGE
+    if STORAGE is None:
+        STORAGE = storage.get_storage(DATA_PATH, DOWNLOAD_PATH)
+    return STORAGE
+
+def _refresh_catalog(force=False):
+    """
+    force: if True, the data directory is scanned even if it did not change
+    Updates the valid states and the warnings about the files in the data directory.
+    The directory is checked at most once every CATALOG_CHECK_INTERVAL seconds, and it is 
+    only scanned again if its version changed (for a local directory its modification time, 
+    i.e. files were added, removed or renamed), so that requests do not list the directory.
+    """
+    global VALID_STATES, WARNINGS
+
+    now = time.monotonic()
+    checked_at = _CATALOG["checked_at"]
+    if not force and checked_at is not None and now - checked_at < CATALOG_CHECK_INTERVAL:
+        return
+    
+    with _CATALOG_LOCK:
+        checked_at = _CATALOG["checked_at"]
+        if not force and checked_at is not None and now - checked_at < CATALOG_CHECK_INTERVAL:
+            return
+        version = get_storage().get_version()
+        if force or version != _CATALOG["version"]:
+            filenames = get_storage().list_files()
+            # replace (not update) the valid states and warnings, so readers never see them
+            # partially updated
+            VALID_STATES = {state for state in STATE_CODES if f"{state}.xlsx" in filenames}
+            WARNINGS = _file_warnings(filenames)
+            _CATALOG["version"] = version
+        _CATALOG["checked_at"] = time.monotonic()
 
 #endregion
 
 #region DATA LOADING + UPDATING
 
-#TODO: Update this with proper data loading for deployment
 def _load_state_data(state_code):
     """
     state_code: string
     Loads the dataframe and configuration for a given state.
     Returns True if the data was loaded successfully, False otherwise.
-    The file must be in the format "state_code.xlsx" and located in the DATA_PATH.
+    The file must be in the format "state_code.xlsx" and located in the storage.
     """
     if state_code not in STATE_CODES:
         return False
     
-    path = DATA_PATH + state_code + ".xlsx"
-
-    if os.path.isfile(path):
-        # load df
-        data = pd.read_excel(path, header=[0, 1, 2])
-        # drop header rows 1 and 2
-        df = data.droplevel([1,2], axis=1)
-        STATE_DF_DICT[state_code] = df.copy()
+    path = get_storage().get_path(state_code + ".xlsx")
 
-        # load config
-        config = pd.DataFrame(data.columns.tolist(), columns=["ID", "Text", "Category"])
-        STATE_CONFIG_DICT[state_code] = config.copy()
+    if path is not None:
+        fingerprint, df, config, memory = _read_state_file(state_code, path)
+        _install_state(state_code, fingerprint, df, config, memory)
         return True
     else:
         return False
 
+def _read_state_file(state_code, path):
+    """
+    state_code: string
+    path: path to the .xlsx file of the state
+    Reads the dataframe and configuration of a state, from the cache if possible.
+    Returns the fingerprint of the file (taken before reading it, so that changes during the
+    load are detected later), the dataframe (with compact data types), the configuration and
+    the memory usage of the dataframe before and after converting the data types.
+    """
+    fingerprint = _file_fingerprint(path)
+    cached = _read_cache(state_code, path)
+    if cached is not None:
+        df, config, memory = cached
+    else:
+        df, config = _read_workbook(path)
+        df, memory = _compact_frame(df, config)
+        _write_cache(state_code, path, df, config, memory)
+    return fingerprint, df, config, memory
+
+def _install_state(state_code, fingerprint, df, config, memory):
+    """
+    state_code: string
+    fingerprint: fingerprint of the file the data was read from
+    df, config: dataframe and configuration of the state
+    memory: memory usage of the dataframe before and after converting the data types
+    Builds the data derived from the dataframe and swaps in the data for the state.
+    """
+    print(f"Memory usage for state {state_code}: {memory[0] / 1e6:.1f} MB, "
+          f"{memory[1] / 1e6:.1f} MB with compact data types")
+    hospitals, warnings = _build_hospital_catalog(state_code, df)
+    partitions = _build_partitions(df)
+    size = memory[1] + sum(rows.nbytes for rows in partitions.values())
+    # swap in dataframe, configuration, hospital catalog and partitions together
+    with _STATE_LOCK:
+        if STATE_FINGERPRINT_DICT.get(state_code) != fingerprint:
+            STATE_VERSION_DICT[state_code] = STATE_VERSION_DICT.get(state_code, 0) + 1
+            STATE_FINGERPRINT_DICT[state_code] = fingerprint
+        STATE_DF_DICT[state_code] = df
+        STATE_CONFIG_DICT[state_code] = config
+        STATE_HOSPITALS_DICT[state_code] = hospitals
+        STATE_PARTITIONS_DICT[state_code] = partitions
+        STATE_MEMORY_DICT[state_code] = memory
+        STATE_WARNINGS[state_code] = warnings
+        _STATE_LRU[state_code] = size
+        _STATE_LRU.move_to_end(state_code)
+        evicted = _evict_states()
+    for state in evicted:
+        for callback in list(_EVICTION_CALLBACKS):
+            callback(state)
+
+def _read_workbook(path):
+    """
+    path: path to the .xlsx file of a state
+    Parses the file and returns the dataframe and the configuration.
+    The sheet is streamed: the three header rows are read first, then the data rows are parsed
+    in chunks of INGEST_CHUNK_ROWS rows and the chunks are concatenated into the final frame, so
+    the whole sheet is never held in memory as cells (see _stream_workbook()).
+    The result is the same as reading the file with pd.read_excel(path, header=[0, 1, 2]), 
+    which is still used for files the stream cannot handle.
+    """
+    data = _stream_workbook(path)
+    if data is None:
+        data = pd.read_excel(path, header=[0, 1, 2])
+    # load config
+    config = pd.DataFrame(data.columns.tolist(), columns=["ID", "Text", "Category"])
+    # drop header rows 1 and 2 (the data is not copied)
+    data.columns = data.columns.droplevel([1, 2])
+    return data, config
+
+def _stream_workbook(path):
+    """
+    path: path to the .xlsx file of a state
+    Reads the first sheet of the file row by row (openpyxl read only mode). The data rows are 
+    collected in chunks of INGEST_CHUNK_ROWS rows, and the data types are inferred once on the 
+    whole columns, as pd.read_excel does (a column can look numeric in one chunk and not in 
+    another), so the whole sheet is never held in memory as lists of cells.
+    Returns the dataframe with the three header rows as columns, or None if the file has less
+    than three rows or data outside of the header columns (pd.read_excel is used instead).
+    """
+    workbook = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = workbook.worksheets[0]
+        sheet.reset_dimensions()
+        rows = sheet.iter_rows()
+        header = [_convert_row(row) for _, row in zip(range(3), rows)]
+        width = max((len(row) for row in header), default=0)
+        if len(header) < 3 or width == 0:
+            return None
+        header = _fill_header([row + [""] * (width - len(row)) for row in header])
+
+        chunks = []
+        chunk = []
+        # repeated text values (e.g. answers) are stored once
+        strings = {}
+        # blank rows are kept (as empty rows) only if a row with data follows
+        blank_rows = 0
+        for row in rows:
+            values = _convert_row(row, strings)
+            if not values:
+                blank_rows += 1
+                continue
+            if len(values) > width:
+                return None
+            chunk.extend([""] * width for _ in range(blank_rows))
+            blank_rows = 0
+            chunk.append(values + [""] * (width - len(values)))
+            if len(chunk) >= INGEST_CHUNK_ROWS:
+                chunks.append(np.array(chunk, dtype=object))
+                chunk = []
+        if chunk:
+            chunks.append(np.array(chunk, dtype=object))
+    finally:
+        workbook.close()
+
+    # the header is parsed as pd.read_excel does (e.g. "Unnamed: 0_level_1" for empty cells)
+    empty = _parse_header(header)
+    if not chunks:
+        return empty
+    data = {i: _infer_column(np.concatenate([c[:, i] for c in chunks])) for i in range(width)}
+    del chunks
+    df = pd.DataFrame(data)
+    df.columns = empty.columns
+    return df
+
+def _convert_row(row, strings=None):
+    """
+    row: tuple of openpyxl cells
+    strings: dictionary used to store each text value only once (optional)
+    Returns the values of the cells as read by pd.read_excel: empty cells as "", error cells as 
+    NaN and whole numbers as int, without the trailing empty cells.
+    """
+    values = []
+    for cell in row:
+        value = cell.value
+        if value is None:
+            value = ""
+        elif cell.data_type == "e":
+            # error cells (e.g. "#DIV/0!") have a text value, so they are checked first
+            value = np.nan
+        elif strings is not None and isinstance(value, str):
+            value = strings.setdefault(value, value)
+        elif cell.data_type == "n":
+            if int(value) == value:
+                value = int(value)
+            else:
+                value = float(value)
+        values.append(value)
+    while values and values[-1] == "":
+        values.pop()
+    return values
+
+def _fill_header(header):
+    """
+    header: the three header rows (lists of the same length)
+    Returns the header rows with empty cells filled with the value on their left, as 
+    pd.read_excel does for multi-row headers. A cell is only filled if the cells above it 
+    were filled too.
+    """
+    filled = [True] * len(header[0])
+    for row in header:
+        last = row[0]
+        for i in range(1, len(row)):
+            if not filled[i]:
+                last = row[i]
+            if row[i] == "" or row[i] is None:
+                row[i] = last
+            else:
+                filled[i] = False
+                last = row[i]
+    return header
+
+def _parse_header(header):
+    """
+    header: the three (filled) header rows
+    Returns an empty dataframe with the header rows as columns, parsed by the parser used by 
+    pd.read_excel.
+    """
+    parser = TextParser(header, header=[0, 1, 2], skip_blank_lines=False)
+    try:
+        return parser.read()
+    finally:
+        parser.close()
+
+# Values read as missing by pd.read_excel
+NA_VALUES = {"", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", 
+             "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"}
+# Text values read as booleans by pd.read_excel
+BOOLEAN_VALUES = {"True": True, "TRUE": True, "true": True, 
+                  "False": False, "FALSE": False, "false": False}
+
+def _infer_column(values):
+    """
+    values: object array with the values of a column
+    Returns the values converted as pd.read_excel does: missing values to NaN, then to numbers 
+    if all values are numbers, else to booleans if all values are booleans, else unchanged.
+    """
+    values[pd.Series(values).isin(NA_VALUES).to_numpy()] = np.nan
+    try:
+        return pd.to_numeric(values)
+    except (ValueError, TypeError):
+        pass
+    # equal values share the first object (e.g. 1 is read as True if True comes first)
+    codes, uniques = pd.factorize(values)
+    values = np.asarray(uniques, dtype=object).take(codes)
+    values[codes < 0] = np.nan
+
+    converted = np.empty(len(values), dtype=object)
+    missing = np.zeros(len(values), dtype=bool)
+    for i, value in enumerate(values):
+        if isinstance(value, (bool, np.bool_)):
+            converted[i] = bool(value)
+        elif isinstance(value, str) and value in BOOLEAN_VALUES:
+            converted[i] = BOOLEAN_VALUES[value]
+        elif isinstance(value, float) and np.isnan(value):
+            converted[i] = np.nan
+            missing[i] = True
+        else:
+            return values
+    if missing.any():
+        return converted
+    return converted.astype(bool)
+
 def get_state_df(state_code):
     """ 
     state_code: string
@@ -146,14 +477,10 @@ def get_state_df(state_code):
     if state_code not in STATE_CODES:
         return None
     
-    if state_code in STATE_DF_DICT:
-        return STATE_DF_DICT[state_code]
-    
-    # if the load is successful, return the dataframe
-    if _load_state_data(state_code):
-        return STATE_DF_DICT[state_code]
-    else:
+    loaded = _get_loaded_state(state_code, STATE_DF_DICT)
+    if loaded is None:
         return None
+    return loaded[0]
     
 def get_config(state_code):
     """ 
@@ -164,14 +491,583 @@ def get_config(state_code):
     if state_code not in STATE_CODES:
         return None
     
-    if state_code in STATE_CONFIG_DICT:
-        return STATE_CONFIG_DICT[state_code]
+    loaded = _get_loaded_state(state_code, STATE_CONFIG_DICT)
+    if loaded is None:
+        return None
+    return loaded[0]
+
+def get_state_data(state_code):
+    """
+    state_code: string
+    Returns the dataframe, the configuration and the data version for a given state code,
+    loading the data if it is not already loaded. The three values always belong to the same 
+    load, even if the state is being reloaded.
+    Returns None if the data could not be loaded.
+    """
+    if state_code not in STATE_CODES:
+        return None
     
-    # if the load is successful, return the configuration
-    if _load_state_data(state_code):
-        return STATE_CONFIG_DICT[state_code]
-    else:
+    return _get_loaded_state(state_code, STATE_DF_DICT, STATE_CONFIG_DICT, STATE_VERSION_DICT)
+
+def get_state_version(state_code):
+    """
+    state_code: string
+    Returns the data version for a given state code (0 if the state was never loaded).
+    The version is increased every time a different file is loaded for the state.
+    """
+    return STATE_VERSION_DICT.get(state_code, 0)
+
+#endregion
+
+#region RELOADING
+
+_RELOADING_STATES = set()
+_AUTO_RELOAD_THREAD = None
+
+def get_changed_states():
+    """
+    Returns the list of loaded states whose file changed on disk (different size or 
+    modification time) since it was loaded. For an object store, files that changed in the 
+    bucket are downloaded first.
+    States whose file was removed are not included, the loaded data is kept for them.
+    """
+    changed = []
+    for state_code, fingerprint in list(STATE_FINGERPRINT_DICT.items()):
+        if state_code not in STATE_DF_DICT:
+            continue
+        try:
+            path = get_storage().get_path(state_code + ".xlsx")
+            if path is not None and _file_fingerprint(path) != fingerprint:
+                changed.append(state_code)
+        except OSError:
+            continue
+    return changed
+
+def reload_changed_states(background=True):
+    """
+    background: if True, every changed state is reloaded in its own thread and the function 
+    returns immediately; if False, the states are reloaded before returning
+    Reloads the states whose file changed on disk. Until the new data is loaded, the old data
+    keeps being served. States that are already being reloaded are skipped.
+    Returns the list of states being reloaded.
+    """
+    reloading = []
+    for state_code in get_changed_states():
+        with _STATE_LOCK:
+            if state_code in _RELOADING_STATES:
+                continue
+            _RELOADING_STATES.add(state_code)
+        reloading.append(state_code)
+        if background:
+            threading.Thread(target=_reload_state, args=(state_code,), daemon=True).start()
+        else:
+            _reload_state(state_code)
+    return reloading
+
+def _reload_state(state_code):
+    """
+    state_code: string
+    Reloads the data for a given state. Errors are printed and the old data is kept.
+    """
+    try:
+        _load_state_data(state_code)
+        print("Reloaded data for state: ", state_code, " version: ", get_state_version(state_code))
+    except Exception as e:
+        print("Could not reload data for state: ", state_code, e)
+    finally:
+        with _STATE_LOCK:
+            _RELOADING_STATES.discard(state_code)
+
+def start_auto_reload(interval=60):
+    """
+    interval: number of seconds between two checks
+    Starts a daemon thread that checks the loaded states every interval seconds and reloads 
+    the ones whose file changed. Only one thread is started per process.
+    """
+    global _AUTO_RELOAD_THREAD
+    if _AUTO_RELOAD_THREAD is not None:
+        return
+
+    def _auto_reload():
+        while True:
+            time.sleep(interval)
+            reload_changed_states(background=False)
+
+    _AUTO_RELOAD_THREAD = threading.Thread(target=_auto_reload, daemon=True)
+    _AUTO_RELOAD_THREAD.start()
+
+#endregion
+
+#region MEMORY BUDGET
+
+# Memory in bytes of each loaded state, from the least to the most recently used
+_STATE_LRU = OrderedDict()
+# Number of lookups of loaded states, of lookups that had to load the state and of evictions
+CACHE_STATS = {"hits": 0, "misses": 0, "evictions": 0}
+# Functions called with the state code of each evicted state (see add_eviction_callback())
+_EVICTION_CALLBACKS = []
+
+def _get_loaded_state(state_code, *dicts):
+    """
+    state_code: string
+    dicts: dictionaries of this module to read (e.g. STATE_DF_DICT, STATE_CONFIG_DICT)
+    Returns a tuple with the values of the state in the given dictionaries, all from the same
+    load, and marks the state as the most recently used one. The state is loaded if needed.
+    Returns None if the data could not be loaded.
+    """
+    hit = True
+    while True:
+        with _STATE_LOCK:
+            if state_code in _STATE_LRU:
+                CACHE_STATS["hits" if hit else "misses"] += 1
+                _STATE_LRU.move_to_end(state_code)
+                return tuple(d[state_code] for d in dicts)
+        # another load can evict the state again before it is read, so try until it is found
+        hit = False
+        if not _load_state_data(state_code):
+            return None
+
+def _evict_states():
+    """
+    Evicts the least recently used states until the memory of the loaded states is within 
+    STATE_MEMORY_BUDGET. The most recently used state is never evicted.
+    Must be called holding _STATE_LOCK. Returns the evicted states, the caller calls the
+    eviction callbacks for them once the lock is released (see add_eviction_callback()).
+    The data of an evicted state is only removed from the dictionaries, so it is freed once 
+    the requests using it are done. Its version and fingerprint are kept, so loading the same 
+    file again does not change the version.
+    """
+    evicted = []
+    if STATE_MEMORY_BUDGET is None:
+        return evicted
+    while len(_STATE_LRU) > 1 and sum(_STATE_LRU.values()) > STATE_MEMORY_BUDGET:
+        state_code, size = _STATE_LRU.popitem(last=False)
+        for state_dict in (STATE_DF_DICT, STATE_CONFIG_DICT, STATE_HOSPITALS_DICT, 
+                           STATE_PARTITIONS_DICT, STATE_MEMORY_DICT, STATE_WARNINGS):
+            state_dict.pop(state_code, None)
+        CACHE_STATS["evictions"] += 1
+        evicted.append(state_code)
+        print(f"Evicted state {state_code} ({size / 1e6:.1f} MB) to stay within the memory budget")
+    return evicted
+
+def add_eviction_callback(callback):
+    """
+    callback: function called with the state code (string) of each evicted state
+    Registers a function to call when a state is evicted, so that other modules can drop the
+    data they derived from the state (e.g. the preprocessed copy of the state in hospital_data).
+    The callbacks are called by the thread that loaded the state causing the eviction.
+    """
+    _EVICTION_CALLBACKS.append(callback)
+
+def add_state_memory(state_code, version, size):
+    """
+    state_code: string
+    version: the data version of the state the data was derived from (see get_state_version())
+    size: memory in bytes of the data derived from the state by another module
+    Adds the memory of data derived from a loaded state (e.g. the preprocessed copy of the state
+    in hospital_data) to the memory of the state, so that it is counted in STATE_MEMORY_BUDGET,
+    marks the state as the most recently used one and evicts states if needed. The memory is 
+    counted until the state is evicted or loaded again, the module should drop the data when the
+    state is evicted (see add_eviction_callback()). Ignored if the state is no longer loaded with
+    this version.
+    """
+    with _STATE_LOCK:
+        if state_code not in _STATE_LRU or STATE_VERSION_DICT.get(state_code) != version:
+            return
+        _STATE_LRU[state_code] += size
+        _STATE_LRU.move_to_end(state_code)
+        evicted = _evict_states()
+    for state in evicted:
+        for callback in list(_EVICTION_CALLBACKS):
+            callback(state)
+
+def get_cache_stats():
+    """
+    Returns a dictionary with the number of hits, misses and evictions of the loaded states, 
+    the memory in bytes used by the loaded states (see add_state_memory()), the memory budget and the loaded states 
+    (from the least to the most recently used).
+    """
+    with _STATE_LOCK:
+        stats = dict(CACHE_STATS)
+        stats["bytes"] = sum(_STATE_LRU.values())
+        stats["budget"] = STATE_MEMORY_BUDGET
+        stats["states"] = list(_STATE_LRU)
+    return stats
+
+#endregion
+
+#region PRELOADING
+
+# Set when the data can be served: immediately if states are loaded lazily (default), after 
+# all states are loaded if start_preload() is called
+PRELOAD_READY = threading.Event()
+PRELOAD_READY.set()
+
+def start_preload(max_workers=None):
+    """
+    max_workers: number of processes used to parse the files (default: number of CPUs)
+    Starts preloading all valid states in a background thread (see preload_states()).
+    PRELOAD_READY is cleared until the preload is complete.
+    """
+    PRELOAD_READY.clear()
+    threading.Thread(target=preload_states, args=(max_workers,), daemon=True).start()
+
+def preload_states(max_workers=None):
+    """
+    max_workers: number of processes used to parse the files (default: number of CPUs)
+    Loads all valid states, parsing the files in parallel in a process pool. The processes
+    send the data back as arrow IPC streams (or pickled dataframes if pyarrow is not installed).
+    Prints the time needed to load each state, sets PRELOAD_READY when all states are loaded 
+    and returns a dictionary from state code to load time in seconds.
+    States that cannot be loaded are skipped (they are loaded lazily on the next request).
+    """
+    _refresh_catalog(force=True)
+    timings = {}
+    start = time.perf_counter()
+    try:
+        # spawn instead of fork, as the process could already be running threads
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers, mp_context=context) as executor:
+            paths = (DATA_PATH, DOWNLOAD_PATH, CACHE_PATH)
+            futures = {executor.submit(_preload_state, paths, state): state 
+                       for state in sorted(VALID_STATES)}
+            for future in as_completed(futures):
+                state_code = futures[future]
+                try:
+                    fingerprint, payload, seconds = future.result()
+                    df, config, memory = _deserialize_state(payload)
+                    _install_state(state_code, fingerprint, df, config, memory)
+                except Exception as e:
+                    print("Could not preload data for state: ", state_code, e)
+                    continue
+                timings[state_code] = seconds
+                print(f"Preloaded state {state_code} in {seconds:.2f}s")
+        print(f"Preloaded {len(timings)} states in {time.perf_counter() - start:.2f}s")
+    finally:
+        PRELOAD_READY.set()
+    return timings
+
+def _preload_state(paths, state_code):
+    """
+    paths: DATA_PATH, DOWNLOAD_PATH and CACHE_PATH of the parent process
+    state_code: string
+    Reads the data for a state in a worker process.
+    Returns the fingerprint of the file, the serialized data and the time needed in seconds.
+    """
+    global DATA_PATH, DOWNLOAD_PATH, CACHE_PATH
+    DATA_PATH, DOWNLOAD_PATH, CACHE_PATH = paths
+    start = time.perf_counter()
+    path = get_storage().get_path(state_code + ".xlsx")
+    fingerprint, df, config, memory = _read_state_file(state_code, path)
+    payload = _serialize_state(df, config, memory)
+    return fingerprint, payload, time.perf_counter() - start
+
+def _serialize_state(df, config, memory):
+    """
+    df, config: dataframe and configuration of a state
+    memory: memory usage of the dataframe before and after converting the data types
+    Serializes the data of a state as an arrow IPC stream (see _frame_to_table()), together 
+    with the column types and the configuration. If pyarrow is not installed or the dataframe
+    cannot be converted, the dataframes are returned as they are (and pickled by the caller).
+    """
+    try:
+        import pyarrow as pa
+        table, columns = _frame_to_table(df)
+    except (ImportError, ValueError, TypeError):
+        return {"df": df, "config": config, "memory": memory}
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return {"arrow": sink.getvalue().to_pybytes(), "columns": columns, 
+            "config": config.values.tolist(), "memory": memory}
+
+def _deserialize_state(payload):
+    """
+    payload: output of _serialize_state()
+    Returns the dataframe, the configuration and the memory usage of a state.
+    """
+    if "arrow" not in payload:
+        return payload["df"], payload["config"], payload["memory"]
+    import pyarrow as pa
+    table = pa.ipc.open_stream(payload["arrow"]).read_all()
+    df = _table_to_frame(table, payload["columns"])
+    df.columns = [c[0] for c in payload["config"]]
+    config = pd.DataFrame(payload["config"], columns=["ID", "Text", "Category"])
+    return df, config, payload["memory"]
+
+#endregion
+
+#region COLUMNAR CACHE
+
+# Version of the cache format, caches with a different version are ignored. It is also increased
+# when the parsing of the files changes (version 3: Excel error cells are read as NaN)
+CACHE_FORMAT_VERSION = 3
+
+# Python types that can appear in object columns with mixed types, with their arrow type names
+MIXED_COLUMN_TYPES = [(bool, "bool"), (int, "int64"), (float, "float64"), (str, "string"),
+                      (datetime.datetime, "timestamp[us]"), (datetime.time, "time64[us]")]
+
+def _cache_paths(state_code):
+    """
+    state_code: string
+    Returns the paths of the Parquet data file and of the JSON sidecar for a given state.
+    """
+    return (os.path.join(CACHE_PATH, state_code + ".parquet"),
+            os.path.join(CACHE_PATH, state_code + ".json"))
+
+def _file_fingerprint(path):
+    """
+    path: path to a file
+    Returns the size and the modification time (in nanoseconds) of the file.
+    """
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+def _file_hash(path):
+    """
+    path: path to a file
+    Returns the sha256 hash of the content of the file.
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def _read_cache(state_code, path):
+    """
+    state_code: string
+    path: path to the .xlsx file of the state
+    Returns the dataframe, the configuration and the memory usage (see _compact_frame()) from
+    the cache if the cache matches the file, None otherwise.
+    If only the modification time changed, the content hash decides whether the cache is still
+    valid (and the sidecar is updated with the new modification time).
+    """
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        return None
+
+    data_path, meta_path = _cache_paths(state_code)
+    if not os.path.isfile(data_path) or not os.path.isfile(meta_path):
+        return None
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        size, mtime = _file_fingerprint(path)
+        if meta.get("format") != CACHE_FORMAT_VERSION or meta["size"] != size:
+            return None
+        if meta["mtime_ns"] != mtime:
+            if meta["sha256"] != _file_hash(path):
+                return None
+            meta["mtime_ns"] = mtime
+            _write_json(meta_path, meta)
+        df = _table_to_frame(pq.read_table(data_path), meta["columns"])
+    except (OSError, ValueError, TypeError, KeyError) as e:
+        print("Could not read the cache for state: ", state_code, e)
         return None
+    df.columns = [c[0] for c in meta["config"]]
+    config = pd.DataFrame(meta["config"], columns=["ID", "Text", "Category"])
+    return df, config, meta["memory"]
+
+def _write_cache(state_code, path, df, config, memory):
+    """
+    state_code: string
+    path: path to the .xlsx file the data was read from
+    df, config: dataframe and configuration of the state
+    memory: memory usage of the dataframe (see _compact_frame())
+    Writes the dataframe to a Parquet file and the configuration to a JSON sidecar, together
+    with the size, modification time and content hash of the .xlsx file.
+    Columns that cannot be stored (e.g. values of unsupported types) disable the cache for the
+    state, the data is then parsed from the .xlsx file on every load.
+    """
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        return
+
+    data_path, meta_path = _cache_paths(state_code)
+    size, mtime = _file_fingerprint(path)
+    try:
+        table, columns = _frame_to_table(df)
+        meta = {"format": CACHE_FORMAT_VERSION, "size": size, "mtime_ns": mtime, 
+                "sha256": _file_hash(path), "columns": columns, 
+                "config": config.values.tolist(), "memory": memory}
+        # fail before writing anything if the configuration cannot be stored
+        json.dumps(meta)
+        os.makedirs(CACHE_PATH, exist_ok=True)
+        _replace_file(data_path, lambda tmp_path: pq.write_table(table, tmp_path))
+        _write_json(meta_path, meta)
+    except (OSError, ValueError, TypeError) as e:
+        print("Could not write the cache for state: ", state_code, e)
+
+def _write_json(path, content):
+    """
+    Writes content to path as JSON, replacing the file atomically.
+    """
+    def write(tmp_path):
+        with open(tmp_path, "w") as f:
+            json.dump(content, f)
+    _replace_file(path, write)
+
+def _replace_file(path, write):
+    """
+    path: path of the file to write
+    write: function that writes the content of the file to the path it is given
+    Writes the file to a temporary file with a unique name in the same directory and then
+    replaces the file atomically, so that concurrent writers (threads or processes loading the
+    same state) never write to the same temporary file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), 
+                                    prefix=os.path.basename(path) + ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _frame_to_table(df):
+    """
+    df: dataframe
+    Converts the dataframe to an arrow table with one or more columns for each column of df.
+    Columns are named by position, as question IDs might not be unique.
+    Object columns that only contain strings are stored as strings; object columns with mixed 
+    types are split into one column per type plus an int8 column with the index of the type 
+    of each value (-1 for null values), so that values keep their python types.
+    Returns the table and the list of column types needed to convert it back.
+    """
+    import pyarrow as pa
+
+    arrays = {}
+    columns = []
+    for i in range(df.shape[1]):
+        column = df.iloc[:, i]
+        if column.dtype != object or pd.api.types.infer_dtype(column) in ["string", "empty"]:
+            arrays[str(i)] = pa.Array.from_pandas(column)
+            columns.append("plain")
+            continue
+        values = column.tolist()
+        tags = np.full(len(values), -1, dtype=np.int8)
+        for j, value in enumerate(values):
+            if value is None or (isinstance(value, float) and np.isnan(value)):
+                continue
+            for t, (python_type, _) in enumerate(MIXED_COLUMN_TYPES):
+                if isinstance(value, python_type):
+                    tags[j] = t
+                    break
+            else:
+                raise TypeError(f"Unsupported value type in column {column.name}: {type(value)}")
+        arrays[f"{i}.type"] = pa.array(tags)
+        for t, (_, arrow_type) in enumerate(MIXED_COLUMN_TYPES):
+            if (tags == t).any():
+                typed_values = [v if tag == t else None for v, tag in zip(values, tags)]
+                arrays[f"{i}.{t}"] = pa.array(typed_values, type=pa.type_for_alias(arrow_type))
+        columns.append("mixed")
+    return pa.table(arrays), columns
+
+def _table_to_frame(table, columns):
+    """
+    table: arrow table created by _frame_to_table
+    columns: list of column types returned by _frame_to_table
+    Converts the table back to a dataframe (with columns named by position).
+    """
+    data = {}
+    for i, kind in enumerate(columns):
+        if kind == "plain":
+            column = table.column(str(i)).to_pandas()
+            if column.dtype == object:
+                # arrow returns None for null strings, pandas uses NaN
+                column[column.isna()] = np.nan
+            data[i] = column
+            continue
+        tags = table.column(f"{i}.type").to_numpy()
+        values = np.full(len(tags), np.nan, dtype=object)
+        for t in range(len(MIXED_COLUMN_TYPES)):
+            if f"{i}.{t}" in table.column_names:
+                typed_values = table.column(f"{i}.{t}").to_pylist()
+                for j in np.flatnonzero(tags == t):
+                    values[j] = typed_values[j]
+        data[i] = pd.Series(values, dtype=object)
+    return pd.DataFrame(data)
+
+#endregion
+
+#region COMPACT DATA TYPES
+
+# Text columns are stored as categoricals if they have at most this ratio of unique values
+CATEGORICAL_MAX_UNIQUE_RATIO = 0.5
+
+def _compact_frame(df, config):
+    """
+    df, config: dataframe and configuration of a state
+    Returns the dataframe with compact data types and its memory usage in bytes before and 
+    after the conversion:
+    - text columns with few unique values are converted to categoricals
+    - integer columns are converted to the narrowest integer type
+    - float columns are converted to float32 if no value changes
+    - columns of category "date" are converted to datetime64 (if all values can be parsed)
+    """
+    before = int(df.memory_usage(deep=True).sum())
+    categories = config["Category"].tolist()
+    columns = {}
+    for i in range(df.shape[1]):
+        column = df.iloc[:, i]
+        if categories[i] == "date" and column.dtype == object:
+            try:
+                column = pd.to_datetime(column)
+            except (ValueError, TypeError):
+                pass
+        if pd.api.types.is_bool_dtype(column.dtype):
+            pass
+        elif pd.api.types.is_integer_dtype(column.dtype):
+            column = pd.to_numeric(column, downcast="integer")
+        elif pd.api.types.is_float_dtype(column.dtype):
+            compact = column.astype(np.float32)
+            if ((compact == column) | column.isna()).all():
+                column = compact
+        elif column.dtype == object and pd.api.types.infer_dtype(column) == "string":
+            if column.nunique() <= CATEGORICAL_MAX_UNIQUE_RATIO * column.count():
+                column = column.astype("category")
+        columns[i] = column
+    compact = pd.DataFrame(columns)
+    compact.columns = df.columns
+    after = int(compact.memory_usage(deep=True).sum())
+    return compact, [before, after]
+
+def restore_dtypes(df):
+    """
+    df: dataframe with compact data types (see _compact_frame())
+    Returns a copy of the dataframe with the standard data types the preprocessing expects:
+    categoricals are converted back to object columns, integers to int64 and floats to float64.
+    If no column needs to be converted, the dataframe itself is returned.
+    """
+    dtypes = {}
+    for i, dtype in enumerate(df.dtypes):
+        if isinstance(dtype, pd.CategoricalDtype):
+            dtypes[i] = object
+        elif pd.api.types.is_bool_dtype(dtype):
+            continue
+        elif pd.api.types.is_integer_dtype(dtype) and dtype != np.int64:
+            dtypes[i] = np.int64
+        elif pd.api.types.is_float_dtype(dtype) and dtype != np.float64:
+            dtypes[i] = np.float64
+    if len(dtypes) == 0:
+        return df
+    columns = {i: df.iloc[:, i].astype(dtypes[i]) if i in dtypes else df.iloc[:, i] 
+               for i in range(df.shape[1])}
+    restored = pd.DataFrame(columns)
+    restored.columns = df.columns
+    return restored
+
+def get_memory_usage(state_code):
+    """
+    state_code: string
+    Returns the memory usage in bytes of the dataframe of a loaded state before and after
+    converting to compact data types, or None if the state is not loaded.
+    """
+    return STATE_MEMORY_DICT.get(state_code)
 
 #endregion
 
@@ -188,42 +1084,86 @@ def get_hospital_df(state, hospital):
         print("Invalid hospital: ", hospital, " for state: ", state)
         return None
     
+    df, partitions = _get_partitioned_state_df(state)
+    return take_hospital_rows(df, partitions, state, hospital)
+
+def take_hospital_rows(df, partitions, state, hospital):
+    """
+    df: dataframe of a state, or a dataframe derived from it with the same rows in the same 
+    order (e.g. preprocessed)
+    partitions: the row positions of each hospital in the dataframe of the state (from the same
+    load, see get_partitioned_state_data())
+    state: state code
+    hospital: hospital url (lowercase name with no spaces and no non-alphanumeric characters)
+    Returns the rows of the hospital with a new index, or the dataframe itself for 
+    "All Hospitals".
+    """
     hospital = get_formatted_hospital(state, hospital)
     hospital = hospital['name']
-
-    df = get_state_df(state)
-    site_column = "site_name"
     
     if hospital == "All Hospitals":
         return df
     else:
-        hospital_df = df[df[site_column] == hospital]
+        # only the rows of the hospital are copied
+        rows = partitions.get(hospital, np.empty(0, dtype=np.int32))
+        hospital_df = df.take(rows)
         #reset index
         hospital_df.reset_index(drop=True, inplace=True)
         return hospital_df
 
+def _get_partitioned_state_df(state):
+    """
+    state: state code
+    Returns the dataframe of a given state and the row positions of each hospital in it 
+    (from the same load of the state).
+    """
+    loaded = _get_loaded_state(state, STATE_DF_DICT, STATE_PARTITIONS_DICT)
+    if loaded is None:
+        return None, {}
+    return loaded
+
+def get_partitioned_state_data(state_code):
+    """
+    state_code: string
+    Returns the dataframe, the configuration, the data version and the row positions of each 
+    hospital for a given state code (see get_state_data() and take_hospital_rows()), all from 
+    the same load of the state.
+    Returns None if the data could not be loaded.
+    """
+    if state_code not in STATE_CODES:
+        return None
+    
+    return _get_loaded_state(state_code, STATE_DF_DICT, STATE_CONFIG_DICT, STATE_VERSION_DICT,
+                             STATE_PARTITIONS_DICT)
+
+def _build_partitions(df):
+    """
+    df: dataframe of a state
+    Returns a dictionary from hospital name to the positions of the rows of the hospital in 
+    the dataframe, so that the dataframe of a hospital can be taken without scanning the 
+    whole state. Positions are stored as int32 to halve the memory needed (4 bytes per row).
+    """
+    site_column = "site_name"
+    if site_column not in df.columns:
+        return {}
+    indices = df.groupby(site_column, sort=False, observed=True).indices
+    dtype = np.int32 if len(df) < np.iinfo(np.int32).max else np.int64
+    return {hospital: rows.astype(dtype) for hospital, rows in indices.items()}
+
 #endregion
 
 #region VALIDITY CHECKS
 
-#TODO: Update this with proper data loading for deployment
 def valid_state(state):
     """ 
     state: state code
     returns True if there is a file corresponding to the state code, False otherwise.
     This function does not try to load the data, it only checks if the file exists, so errors
     might still occur when trying to load the data.
+    The files are looked up in the catalog of the data directory (see _refresh_catalog()).
     """
-    if state in VALID_STATES:
-        return True
-    
-    # update valid states
-    files = os.listdir(DATA_PATH)
-    if f"{state}.xlsx" in files:
-        VALID_STATES.add(state)
-        return True
-
-    return False
+    _refresh_catalog()
+    return state in VALID_STATES
 
 def valid_hospital(state, hospital):
     """
@@ -234,10 +1174,7 @@ def valid_hospital(state, hospital):
     if not valid_state(state):
         return False
     
-    for h in get_hospitals_list(state):
-        if h['url'] == hospital:
-            return True
-    return False
+    return hospital in get_hospital_catalog(state)
 
 #endregion
 
@@ -268,23 +1205,48 @@ def get_hospitals_list(state):
     if not valid_state(state):
         return []
 
-    df = get_state_df(state)
-    
+    return list(get_hospital_catalog(state).values())
+
+def get_hospital_catalog(state):
+    """
+    state: state code
+    Returns the hospital catalog for a given state: a dictionary from hospital url to the 
+    formatted hospital (see get_hospitals_list()), in the order of the hospital selection page.
+    The catalog is built when the state is loaded and replaced when the state is reloaded
+    (or loaded again after being evicted).
+    Returns an empty dictionary if the data for the state could not be loaded.
+    """
+    loaded = _get_loaded_state(state, STATE_HOSPITALS_DICT)
+    if loaded is None:
+        return {}
+    return loaded[0]
+
+def _build_hospital_catalog(state, df):
+    """
+    state: state code
+    df: dataframe of the state
+    Returns the hospital catalog for the state (see get_hospital_catalog()) and a list of 
+    warnings for the state.
+    If two hospitals have the same url, only the first one is kept.
+    """
     all = "All Hospitals"
     site_column = "site_name"
+    warnings = []
     if site_column not in df.columns:
-        if state not in STATE_WARNINGS:
-            STATE_WARNINGS[state] = []
-        STATE_WARNINGS[state].append(f"Column 'site_name' not found in data for state: {state}. Only 'All Hospitals' available.")
-        return format_hospitals([all])
-    hospitals = df[site_column].unique().tolist()
-    hospitals.insert(0, all)
-    # remove "site_name" and nan
-    if "site_name" in hospitals:
-        hospitals.remove("site_name")
-    if np.nan in hospitals:
-        hospitals.remove(np.nan)
-    return format_hospitals(hospitals)
+        warnings.append(f"Column 'site_name' not found in data for state: {state}. Only 'All Hospitals' available.")
+        hospitals = [all]
+    else:
+        hospitals = df[site_column].unique().tolist()
+        hospitals.insert(0, all)
+        # remove "site_name" and nan
+        if "site_name" in hospitals:
+            hospitals.remove("site_name")
+        if np.nan in hospitals:
+            hospitals.remove(np.nan)
+    catalog = {}
+    for h in format_hospitals(hospitals):
+        catalog.setdefault(h['url'], h)
+    return catalog, warnings
 
 def format_hospitals(hospitals):
     """
@@ -310,11 +1272,10 @@ def get_formatted_hospital(state, hospital_url):
     Returns the formatted hospital dictionary for a given state and hospital url.
     The state is necessary to check that the hospital is valid.
     """
-    hospitals = get_hospitals_list(state)
-    for h in hospitals:
-        if h['url'] == hospital_url:
-            return h
-    return None
+    if not valid_state(state):
+        return None
+
+    return get_hospital_catalog(state).get(hospital_url)
 
 #endregion
 
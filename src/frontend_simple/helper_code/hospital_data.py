@@ -12,10 +12,42 @@ performs the necessary preprocessing and anonymization steps.
 - Configuration: represents the configuration for a state and provides helper methods. It is
 used internally by HospitalData to access the configuration and process data preprocessing 
 and requests. It should not be used directly.
+- BaseConfiguration: the configuration of a state for one data version, shared by the
+Configuration objects of all hospitals of the state (which only store the changes made for the
+hospital). It is returned by get_base_configuration() and should not be used directly.
+- PreprocessedState: the data of a state for one data version, preprocessed with the steps that
+only depend on each row (configuration, months of the dates, standard answers and the censored
+texts of the open feedback). It is shared by the HospitalData objects of all hospitals of the 
+state, which take their rows from it and only run the steps that depend on the rows of the 
+hospital (data types, answer lists, anonymization). It is returned by get_preprocessed_state()
+and should not be used directly.
 - AnswerList: represents a list of answers for a question. It is used internally by
 Configuration to store the answer lists for each question. It should not be used directly.
 
+Preprocessing a hospital (in particular censoring the feedback) is slow, so the app should use 
+get_hospital_data(), which returns a preprocessed HospitalData object from a cache keyed by 
+state, hospital and data version (see data_loader.get_state_version()). When a state file 
+changes, its version changes and the hospitals of the state are preprocessed again. The cache 
+keeps at most HOSPITAL_DATA_CACHE_SIZE objects, evicting the least recently used ones, and can
+be cleared with invalidate_hospital_data(). HospitalData objects are shared between requests:
+after preprocessing, only the results computed on first use (feedback, word counts, sentiment 
+scores) are set, each one assigned once it is complete, so that a concurrent request never sees
+a partial result (at worst both requests compute it). The censored texts are also stored in a
+persistent cache on disk shared by all processes (see get_censor_cache()), so that each text is
+only censored once for a given spaCy model. The PreprocessedState of each state is kept for its
+latest data version (a copy of the data of the state with the standard data types, whose 
+memory is counted in the memory budget of the data_loader module). The PreprocessedState and the
+HospitalData objects of a state are removed when the data_loader module evicts the state to stay
+within its memory budget.
+When new surveys are appended to a state file, the rows of the previous version are recognized
+by their fingerprints and only the new rows are preprocessed for the state; the texts already 
+censored are not censored again and the monthly counts of the cached hospitals are updated with
+the new rows. The steps that depend on all rows of a hospital (anonymization, answer lists) are
+always run again on the combined rows.
+
 Preprocessing steps:
+- restore the standard data types (the data_loader module stores the data with compact data 
+types, e.g. categoricals for text columns)
 - configuration preprocessing: 
     - remove columns marked as "info"
     - remove duplicate columns for categories which should only have one column (only the first
@@ -28,9 +60,10 @@ Preprocessing steps:
     - check that all ONE_COLUMN_CATEGORIES are present and add an error if they are not
     - remove columns with unallowed categories and add a warning if there are any
 - date preprocessing:
-    - convert the date to datetime format
-    - add a column "Year-Month" with the date in the format "YYYY-MM" (this column is also added
-    to the configuration with category "Year-Month" and ID "Year-Month")
+    - convert the date to datetime format (the format is detected once for the whole column)
+    - add a column "Year-Month" with the month of the date as a monthly period (this column is 
+    also added to the configuration with category "Year-Month" and ID "Year-Month"); months are
+    only formatted as "YYYY-MM" strings when they are returned (see survey_trend_by_month())
 - standardize answers:
     - replace "Prefers not to answer" with "Prefer not to answer"
     - replace "other" with "Other"
@@ -39,7 +72,8 @@ Preprocessing steps:
     - replace values that occur less than MIN_K times with "Other" for demographics questions
     - group numerical questions into ranges so that each range has at least MIN_K values
 - censor feedback:
-    - replace entities with underscores in open feedback
+    - replace entities with underscores in open feedback (the distinct texts are streamed through
+    spaCy in batches, with only the components needed to recognize the entities)
 
 The following methods are provided by the HospitalData class:
 - errors and warnings:
@@ -47,9 +81,9 @@ The following methods are provided by the HospitalData class:
     - get_warnings(): returns a list of warnings concerning the data
 - general information and statistics:
     - total_survey_number(): returns the total number of surveys
-    - survey_trend_by_month(): returns the number of surveys for each year-month pair as a 
-    dictionary with the keys being the year-month ("YYYY-MM" format) and the values being the 
-    number of surveys
+    - survey_trend_by_month(start, end): returns the number of surveys for each year-month pair
+    as a dictionary with the keys being the year-month ("YYYY-MM" format) and the values being 
+    the number of surveys (optionally only for the months from start to end)
     - start_date(): returns the earliest date for which there is a survey in the format "MM/DD/YYYY"
     - end_date(): returns the latest date for which there is a survey in the format "MM/DD/YYYY"
     - huddle_sumup(): returns the sumup of the huddle as a dictionary with the keys "Huddle Yes" 
@@ -59,7 +93,7 @@ The following methods are provided by the HospitalData class:
     - get_feedback(): returns the open feedback concatenated in one dataframe with one column
     "Feedback"
     - get_word_counts(): returns a dictionary with all unique words in the feedback and their
-    counts, ordered by count
+    counts (the number of feedbacks containing the word), ordered by count
     - get_top_words(n): returns the top n words in the feedback as a list without their respective
     counts
     - get_word_count(word): returns the count of the word in the feedback
@@ -69,6 +103,9 @@ The following methods are provided by the HospitalData class:
 - multiple choice:
     - get_multiple_choice(question_id): returns answers to the multiple choice question in a 
     dictionary with the keys being the answers and the values being the counts
+    - get_multiple_choices(question_ids, category): returns the answers to several multiple 
+    choice questions (or all questions of a category) in a dictionary with the question IDs as
+    keys, counting each question in a single pass
 
 Notes about the open feedback:
 - All functions that return feedback return censored feedback.
@@ -96,6 +133,8 @@ The following methods are provided by the Configuration class:
 import pandas as pd
 import numpy as np
 import re, os
+import threading
+from collections import Counter, OrderedDict
 import spacy
 from nltk.corpus import stopwords
 from nltk.stem import SnowballStemmer
@@ -106,12 +145,28 @@ sentiment_model_name = "cardiffnlp/twitter-roberta-base-sentiment-latest"
 
 import helper_code.data_loader as dl
 import helper_code.multiplechoice_const as mc
+import helper_code.censor_cache as cc
 
 # K-anonymity parameter
 # If a value occurs less than MIN_K times, it is replaced with "Other"
 # (Only applied to demographics questions)
 MIN_K = 5
 ONE_COLUMN_CATEGORIES = ["huddle", "age", "insurance", "race", "education", "date", "site_name"]
+# Answers standardized in all text columns: answer -> standard answer
+STANDARD_ANSWERS = {"Prefers not to answer": "Prefer not to answer", "other": "Other"}
+# Answer used for null values
+NULL_ANSWER = "Prefer not to answer"
+# Maximum number of preprocessed HospitalData objects kept in the cache
+HOSPITAL_DATA_CACHE_SIZE = 32
+# Number of texts of the open feedback censored together by spaCy (see nlp.pipe())
+CENSOR_BATCH_SIZE = 256
+# Number of processes used by spaCy to censor the open feedback (1: censored in the app process)
+CENSOR_N_PROCESS = 1
+# File of the persistent cache of the censored texts, in the cache directory of data_loader
+CENSOR_CACHE_FILE = "censored.sqlite"
+# Version of the censoring of a spaCy doc (see _censor_doc()), to increase when it changes so 
+# that the texts in the persistent cache are censored again
+CENSOR_FORMAT_VERSION = 1
 ALLOWED_CATEGORIES = ["date", "info", "preference", "open_feedback", "huddle", "age", "insurance", 
                       "race", "education", "site_name", "Year-Month", "trust", "hospital_xp",
                       "demographics"]
@@ -124,31 +179,37 @@ class HospitalData:
     """
 
 
-    def __init__(self, state_code, hospital_url):
+    def __init__(self, state_code, hospital_url, previous=None):
         """
         state_code: the state code (string)
         hospital_url: the hospital url (string) (lowercase, no spaces, no punctuation)
+        previous: the HospitalData of the hospital for a previous data version (optional), 
+        whose monthly counts are updated if only new rows were added (see _update_month_counts())
         """
         self.state = state_code
         self.hospital = hospital_url
-        self.df = dl.get_hospital_df(state_code, hospital_url)
+        # the preprocessing steps that do not depend on the hospital are only run once per state
+        state_data = get_preprocessed_state(state_code)
+        self.df = state_data.get_hospital_df(hospital_url) if state_data is not None else None
         if self.df is None:
             raise ValueError("Invalid state or hospital: ", state_code, hospital_url)
-        self.config = Configuration(state_code)    
+        self.version = state_data.version
+        self.config = state_data.config.copy()
 
-        self.errors = []
-        self.warnings = []
-
-        if self.df is None or self.config is None:
-            raise ValueError("Invalid state or hospital: ", state_code, hospital_url)
+        self.errors = list(state_data.errors)
+        self.warnings = list(state_data.warnings)
 
-        self.preprocess()
+        self.preprocess(state_data)
         self.feedback = None
         self.preprocessed_feedback = None
         self.stemmed_feedback = None
         self.word_counts = None
         self.stemmer = SnowballStemmer('english')
+        # stems of the words of the feedback (see _stem())
+        self.stems = {}
         self.sentiment_scores = None
+        self.month_counts = None
+        self._update_month_counts(previous, state_data)
     
 
     #region Errors and Warnings
@@ -169,130 +230,57 @@ class HospitalData:
 
     #region Preprocessing (multiple choice and open feedback)
 
-    def preprocess(self):
-        """
-        Preprocesses the data:
-        - configuration preprocessing (see preprocess_config() method)
-        - converts the date to datetime format and adds a column "Year-Month" with the date in 
-        the format "YYYY-MM"
-        - replaces "Prefers not to answer" with "Prefer not to answer"
-        - replaces "other" with "Other"
-        - replaces null values with "Prefer not to answer"
+    def preprocess(self, state_data):
+        """
+        state_data: the PreprocessedState of the state of the hospital
+        Preprocesses the data. The steps that only depend on each row are run once for the 
+        whole state (see PreprocessedState), so the rows of the hospital taken from it are already:
+        - restored to the standard data types (see data_loader.restore_dtypes())
+        - preprocessed based on the configuration (see PreprocessedState._preprocess_config())
+        - with a column "Year-Month" with the month of the date (if the date is in datetime format)
+        - with "Prefers not to answer" replaced with "Prefer not to answer" and "other" replaced 
+        with "Other"
+        The steps that depend on the rows of the hospital are run here:
+        - converts the date to datetime format if the dates have different formats
         - anonymizes the demographics questions
-        - censors the open feedback
+        - censors the open feedback (the censored texts are shared by the hospitals of the state)
+        - replaces null values with "Prefer not to answer"
         """
-        self._preprocess_config()
-        self._preprocess_date()
-        
-        # Standardize: replace "Prefers not to answer" with "Prefer not to answer"
-        for c in self.df.columns:
-            to_change_df = self.df[self.df[c] == "Prefers not to answer"]
-            # if there are values to change
-            if not to_change_df.empty:
-                self.df.loc[self.df[c] == "Prefers not to answer", c] = "Prefer not to answer"
-        # Standardize: replace "other" with "Other"
-        for c in self.df.columns:
-            to_change_df = self.df[self.df[c] == "other"]
-            # if there are values to change
-            if not to_change_df.empty:
-                self.df.loc[self.df[c] == "other", c] = "Other"
-        
+        self._preprocess_date(state_data)
         self._compute_answers_lists()
         self._anonymize_data()
-        self._censor_feedback()
+        self._censor_feedback(state_data)
 
         # Standardize: convert to string and replace null values with "Prefer not to answer" 
         # to do after everything else as it could modify column data type
-        for c in self.df.columns:
-            if self.df[c].dtype == float or self.df[c].dtype == int:
-                self.df[c] = self.df[c].astype(str)
-            self.df[c] = self.df[c].fillna("Prefer not to answer")
+        numerical = self.df.columns[self.df.dtypes.isin([np.dtype(float), np.dtype(int)])]
+        if len(numerical) > 0:
+            self.df[numerical] = self.df[numerical].astype(str)
+        self.df = self.df.fillna(NULL_ANSWER)
     
-    def _preprocess_config(self):
-        """
-        This should always be called before any other preprocessing steps as it modifies 
-        the configuration and could prevent errors in further steps.
-        Preprocessing steps based on the configuration:
-        - remove columns marked as "info"
-        - remove duplicate columns for categories which should only have one column
-        (and add a warning if there are more than one column for a category)
-        - remove duplicate question IDs
-        - remove columns marked as "_TEXT" unless they are open feedback or one of the
-        one column categories
-        - check that df columns match the configuration and delete not-matching columns
-        - check that all one column categories are present
-        - remove columns with unallowed categories and add a warning if there are any
+    def _preprocess_date(self, state_data):
         """
-
-        # Remove columns marked as "info"
-        info_columns = self.config.get_columns_of_category("info")
-        if info_columns is not None and len(info_columns) > 0:
-            self.df = self.df.drop(columns=info_columns)
-            self.config.remove_columns(info_columns)
-        
-        # Remove duplicate columns for categories which should only have one column
-        for category in ONE_COLUMN_CATEGORIES:
-            columns = self.config.get_columns_of_category(category)
-            if len(columns) > 1:
-                self.warnings.append(f"{len(columns)} columns for category {category}. Only the first column will be kept.")
-                self.df = self.df.drop(columns=columns[1:])
-                self.config.remove_columns(columns[1:])
-        
-        # Remove questions with duplicate IDs
-        ids = self.df.columns.tolist()
-        duplicates = set([x for x in ids if ids.count(x) > 1])
-        for d in duplicates:
-            self.warnings.append(f"Duplicate question ID: {d}. The question will be deleted.")
-            self.df = self.df.drop(columns=d)
-            self.config.remove_columns([d])
-        
-        # Remove columns that end as "_TEXT"
-        text_columns = [c for c in self.df.columns if c.endswith("_TEXT")]
-        for c in text_columns:
-            if self.config.get_category_of_column(c) not in ["open_feedback"] and self.config.get_category_of_column(c) not in ONE_COLUMN_CATEGORIES:
-                self.df = self.df.drop(columns=c)
-                self.config.remove_columns([c])
-        
-        # Check that df columns match the configuration
-        df_columns = self.df.columns.tolist()
-        config_columns = self.config.get_ids()
-        for c in df_columns:
-            if c not in config_columns:
-                self.errors.append(f"An error occured with question {c}. The column will be deleted.")
-                self.df = self.df.drop(columns=c)
-        
-        # Check that all one column categories are present
-        categories = self.config.get_categories()
-        for category in ONE_COLUMN_CATEGORIES:
-            if category not in categories:
-                self.errors.append(f"Missing question category: {category}.")
-        
-        # Remove columns with unallowed categories
-        for q_id in self.df.columns:
-            category = self.config.get_category_of_column(q_id)
-            if category not in ALLOWED_CATEGORIES:
-                self.warnings.append(f"Unallowed category for question {q_id}: {category}. The question will be deleted.")
-                self.df = self.df.drop(columns=q_id)
-                self.config.remove_columns([q_id])
-
-    def _preprocess_date(self):
-        """
-        Converts the date column to datetime format and adds a column "Year-Month" with the date
-        in the format "YYYY-MM".
+        state_data: the PreprocessedState of the state of the hospital
+        Converts the date column to datetime format and adds a column "Year-Month" with the month
+        of the date (pandas monthly period), unless this was done for the whole state (see
+        PreprocessedState._preprocess_date()).
         The date column is necessary to get the start and end date, while the "Year-Month" column
         is used for monthly trends.
+        The dates are parsed in one call for the whole column: the format is detected from the 
+        first date, and if not all dates have the same format each date is parsed on its own.
         """
-        date_column = self.config.get_columns_of_category("date")[0]
-        
-        self.df.loc[:, date_column] = self.df[date_column].apply(pd.to_datetime)
-        self.df["Year-Month"] = self.df[date_column].apply(self._date_to_year_month)
+        if state_data.dates_preprocessed:
+            return
+        date_column = state_data.date_column
         
-    def _date_to_year_month(self, date):
-        """
-        date: datetime object
-        returns the date in the format "YYYY-MM"
-        """
-        return f"{date.year}-{date.month:02d}"
+        dates = self.df[date_column]
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            try:
+                dates = pd.to_datetime(dates)
+            except (ValueError, TypeError):
+                dates = pd.to_datetime(dates, format="mixed")
+            self.df[date_column] = dates
+        self.df["Year-Month"] = dates.dt.to_period("M")
 
     def _anonymize_data(self):
         """
@@ -322,78 +310,39 @@ class HospitalData:
             return
         
         value_counts = self.df[question_id].value_counts()
-        keys = value_counts.keys().tolist()
-
-        for key in keys:
-            if pd.isna(key):
-                continue
-            if key == "Prefer not to answer":
-                continue
-            if value_counts[key] < MIN_K:
-                self.df.loc[self.df[question_id] == key, question_id] = "Other"
+        # all rare values are replaced at once (null values and "Prefer not to answer" are kept)
+        rare_keys = [key for key, count in value_counts.items() 
+                     if count < MIN_K and not pd.isna(key) and key != "Prefer not to answer"]
+        if len(rare_keys) > 0:
+            self.df.loc[self.df[question_id].isin(rare_keys), question_id] = "Other"
     
-    def _censor_feedback(self):
+    def _censor_feedback(self, state_data):
         """
+        state_data: the PreprocessedState of the state of the hospital
         Censors the open feedback by replacing entities with underscores.
         """
         columns = self.config.get_columns_of_category("open_feedback")
         if columns is None or len(columns) == 0:
             return
+        # the texts of all columns are censored in batches (each text only once for the state)
+        state_data.censor_texts([text for col in columns for text in self.df[col].unique()])
         for col in columns:
-            # apply _censor_entities to each row
-            self.df[col] = self.df[col].apply(self._censor_entities)
+            self.df[col] = self.df[col].apply(state_data.censor)
 
-    def _censor_entities(self, text):
-        """
-        text: the text to censor (string)
-        Returns text with the entities censored with underscores.
-        """
-        if pd.isna(text):
-            return text
-        doc = nlp(text)
-        censored_text = ' '.join(['_' if token.ent_type_ else token.text for token in doc])
-        # delete spaces before ".", ",", "?", "!", ":", ";", ")", "]", "}", "'"
-        censored_text = re.sub(r'\s([.,?!:;)\]}\'"])', r'\1', censored_text)
-        # delete spaces after "(", "[", "{", "'"
-        censored_text = re.sub(r'([(\[{\'"]) ', r'\1', censored_text)
-        return censored_text
-    
     def _anonymize_numerical_question(self, column):
         """
         column: the id of the question to anonymize (string)
         column should be a numerical question.
         The function groups the answers to the question in ranges i-i+range and a last range
         last_value+, automatically selecting both the range size and the last value so that
-        each bucket has at least MIN_K values.
+        each bucket has at least MIN_K values (see _choose_numerical_ranges()).
         """
         # check that the column is numerical
         if self.df[column].dtype != float and self.df[column].dtype != int:
             return
         
         max_value = int(self.df[column].max()) + 1
-        last_value = max_value + 1
-        min_range = 1
-
-        chosen_range = False
-        while not chosen_range:
-            chosen_range = True
-            # check that every bucket has at least MIN_K values
-            for i in range(0, max_value, min_range):
-                remaining_values = len(self.df[self.df[column] >= i])
-                if i > 0 and remaining_values < MIN_K*2 and remaining_values > MIN_K:
-                    last_value = i
-                    break
-
-                count = len(
-                    self.df[(self.df[column] >= i) & (self.df[column] < i + min_range)]
-                    )
-                if count < MIN_K and count != 0:
-                    increase = 10 ** (len(str(min_range)) - 1)
-                    min_range += increase
-                    chosen_range = False
-                    break
-            if min_range >= max_value:
-                break
+        min_range, last_value = self._choose_numerical_ranges(self.df[column], max_value)
         
         answer_list = []
         for i in range(0, last_value, min_range):
@@ -403,18 +352,70 @@ class HospitalData:
         answer_list.append("Prefer not to answer")
         self.config.set_answer_list(column, answer_list)
         
-        self.df[column] = self.df[column].apply(
-            lambda x: self._replace_numerical_value(x, min_range, last_value)
-        )
+        self.df[column] = self._replace_numerical_values(self.df[column], min_range, last_value)
+
+    def _choose_numerical_ranges(self, values, max_value):
+        """
+        values: the answers to a numerical question (series)
+        max_value: the maximum answer (as int) + 1
+        Returns the range size and the last value for the buckets of the question.
+        Starting from a range size of 1, the buckets 0-range, range-2*range,... are checked in 
+        order: the first bucket with less than MIN_K (but some) values increases the range size
+        (by 1 up to 10, then by 10 up to 100,...) and the check starts again, while the first
+        bucket from which there are less than 2*MIN_K (but more than MIN_K) values left becomes
+        the last range last_value+. The range size is not increased beyond max_value.
+        The values are sorted once and the buckets are counted with binary searches, so each
+        range size is checked without scanning the column again.
+        """
+        values = np.sort(values.dropna().to_numpy())
+        last_value = max_value + 1
+        min_range = 1
+        # values that can fall in the buckets (the buckets start at 0)
+        bucket_values = values[values >= 0]
+        # the last range can only start after the (2*MIN_K)-th largest value
+        threshold = values[len(values) - 2 * MIN_K] if len(values) >= 2 * MIN_K else None
+
+        while True:
+            # first bucket with less than MIN_K values (buckets without values are skipped)
+            buckets, counts = np.unique(np.floor_divide(bucket_values, min_range), return_counts=True)
+            small = np.flatnonzero(counts < MIN_K)
+            small_start = buckets[small[0]] * min_range if len(small) > 0 else None
+
+            # first bucket from which there are less than 2*MIN_K values left
+            if threshold is None or threshold < 0:
+                last_start = min_range
+            else:
+                last_start = (np.floor_divide(threshold, min_range) + 1) * min_range
+            remaining = len(values) - np.searchsorted(values, last_start, side="left")
+            if last_start >= max_value or remaining <= MIN_K:
+                last_start = None
+
+            if last_start is not None and (small_start is None or last_start <= small_start):
+                last_value = int(last_start)
+                break
+            if small_start is None:
+                break
+            min_range += 10 ** (len(str(min_range)) - 1)
+            if min_range >= max_value:
+                break
+        return min_range, last_value
     
-    def _replace_numerical_value(self, value, min_range, last_value):
-        if np.isnan(value):
-            return "Prefer not to answer"
-        if value >= last_value:
-            return f"{last_value}+"
-        lower = value - value % min_range
-        upper = lower + min_range
-        return f"{int(lower)}-{int(upper)}"
+    def _replace_numerical_values(self, values, min_range, last_value):
+        """
+        values: the answers to a numerical question (series)
+        min_range: the range size
+        last_value: the start of the last range last_value+
+        Returns the answers replaced with their ranges ("i-i+range" or "last_value+") and null 
+        values replaced with "Prefer not to answer".
+        """
+        replaced = np.full(len(values), "Prefer not to answer", dtype=object)
+        in_range = (values.notna() & (values < last_value)).to_numpy()
+        lower = (values - values % min_range).to_numpy()[in_range]
+        codes, uniques = pd.factorize(lower)
+        labels = np.array([f"{int(l)}-{int(l + min_range)}" for l in uniques], dtype=object)
+        replaced[in_range] = labels[codes]
+        replaced[(values >= last_value).to_numpy()] = f"{last_value}+"
+        return pd.Series(replaced, index=values.index, name=values.name)
     
     def _compute_answers_lists(self):
         """
@@ -446,33 +447,59 @@ class HospitalData:
         """
         return len(self.df)
 
-    def survey_trend_by_month(self):
+    def survey_trend_by_month(self, start=None, end=None):
         """
+        start: first month to return (e.g. "2023-01" or a date), default: month of the first survey
+        end: last month to return (e.g. "2023-12" or a date), default: month of the last survey
         Returns the number of surveys for each year-month pair.
         Returns a dictionary with the keys being the year-month ("YYYY-MM" format) and the 
         values being the number of surveys for each month.
         Sets all months with no surveys to 0.
+        The surveys are counted once per month (see _get_month_counts()), so different windows
+        do not scan the data again.
+        """
+        month_counts = self._get_month_counts()
+        if len(month_counts) == 0 and (start is None or end is None):
+            return {}
+        start_month = month_counts.index.min() if start is None else pd.Period(start, freq="M")
+        end_month = month_counts.index.max() if end is None else pd.Period(end, freq="M")
+
+        months = pd.period_range(start_month, end_month, freq="M")
+        month_counts = month_counts.reindex(months, fill_value=0)
+
+        # the months are formatted as "YYYY-MM" only here
+        return {month.strftime("%Y-%m"): int(count) for month, count in month_counts.items()}
+
+    def _get_month_counts(self):
+        """
+        Returns the number of surveys for each month with at least one survey (series indexed
+        by monthly period, in chronological order). The counts are computed on the first call.
         """
-        date_column = "Year-Month"
-        start_date = self.df[date_column].min()
-        start_year = start_date[:4]
-        start_month = start_date[5:]
-        end_date = self.df[date_column].max()
-        end_year = end_date[:4]
-        end_month = end_date[5:]
-
-        year_month = {}
-
-        for y in range(int(start_year), int(end_year)+1):
-            for m in range(1, 13):
-                if y == int(start_year) and m < int(start_month):
-                    continue
-                if y == int(end_year) and m > int(end_month):
-                    break
-                year_month[f"{y}-{m:02d}"] = len(self.df[self.df[date_column] == f"{y}-{m:02d}"])
-
-        return year_month
+        if self.month_counts is None:
+            self.month_counts = self.df["Year-Month"].value_counts().sort_index()
+        return self.month_counts
     
+    def _update_month_counts(self, previous, state_data):
+        """
+        previous: the HospitalData of the hospital for a previous data version, or None
+        state_data: the PreprocessedState of the state of the hospital
+        If the rows of the hospital are the rows of the previous version followed by new rows
+        (see PreprocessedState._get_reused_rows()), the monthly counts of the previous version
+        are updated with the months of the new rows instead of counting all rows again.
+        The counts are only updated if the months were computed for the whole state, as dates
+        with different formats could be parsed differently once new rows are added.
+        """
+        if previous is None or previous.month_counts is None or not state_data.dates_preprocessed:
+            return
+        if (previous.state, previous.hospital) != (self.state, self.hospital) or previous.version != state_data.reused_version:
+            return
+        # missing dates are replaced with NULL_ANSWER, so the months can no longer be sorted 
+        if not isinstance(self.df["Year-Month"].dtype, pd.PeriodDtype):
+            return
+        new_months = self.df["Year-Month"].iloc[len(previous.df):]
+        month_counts = previous.month_counts.add(new_months.value_counts(), fill_value=0)
+        self.month_counts = month_counts.astype(np.int64).sort_index()
+
     def start_date(self):
         """
         Returns the earliest date for which there is a survey in the format "MM/DD/YYYY".
@@ -527,12 +554,14 @@ class HospitalData:
         if columns is None or len(columns) == 0:
             return None
         # concatenate columns into one
-        self.feedback = pd.DataFrame()
-        self.feedback["Feedback"] = pd.concat([self.df[col] for col in columns], 
-                                            axis=0, ignore_index=True)
-        self.feedback = self.feedback.dropna()
-        self.feedback.reset_index(drop=True, inplace=True)
-        return self.feedback.copy()
+        feedback = pd.DataFrame()
+        feedback["Feedback"] = pd.concat([self.df[col] for col in columns], 
+                                         axis=0, ignore_index=True)
+        feedback = feedback.dropna()
+        feedback.reset_index(drop=True, inplace=True)
+        # only assigned once complete, as the object can be shared by concurrent requests
+        self.feedback = feedback
+        return feedback.copy()
     
     def _get_preprocessed_feedback(self):
         """
@@ -544,9 +573,10 @@ class HospitalData:
             return self.preprocessed_feedback
         if self.feedback is None:
             self.get_feedback()
-        self.preprocessed_feedback = pd.DataFrame()
-        self.preprocessed_feedback["Feedback"] = self.feedback["Feedback"].apply(self._preprocess_for_word_count)
-        return self.preprocessed_feedback.copy()
+        preprocessed_feedback = pd.DataFrame()
+        preprocessed_feedback["Feedback"] = self.feedback["Feedback"].apply(self._preprocess_for_word_count)
+        self.preprocessed_feedback = preprocessed_feedback
+        return preprocessed_feedback.copy()
 
     def _get_stemmed_feedback(self):
         """
@@ -558,10 +588,11 @@ class HospitalData:
             return self.stemmed_feedback
         if self.preprocessed_feedback is None:
             self._get_preprocessed_feedback()
-        self.stemmed_feedback = pd.DataFrame()
-        self.stemmed_feedback["Feedback"] = self.preprocessed_feedback["Feedback"].apply(
-            lambda x: ' '.join([self.stemmer.stem(word) for word in x.split()]))
-        return self.stemmed_feedback.copy()
+        stemmed_feedback = pd.DataFrame()
+        stemmed_feedback["Feedback"] = self.preprocessed_feedback["Feedback"].apply(
+            lambda x: ' '.join([self._stem(word) for word in x.split()]))
+        self.stemmed_feedback = stemmed_feedback
+        return stemmed_feedback.copy()
 
     def _preprocess_for_word_count(self, text):
         """
@@ -573,7 +604,7 @@ class HospitalData:
         # remove everything that is not a letter
         text = re.sub(r'[^a-z]', ' ', text)
         # remove stopwords
-        stop_words = set(stopwords.words('english'))
+        stop_words = _get_stop_words()
         text = ' '.join([word for word in text.split() if word not in stop_words])
         return text
     
@@ -581,40 +612,46 @@ class HospitalData:
         """
         Returns a dictionary will all unique words in the feedback (excluding stopwords) and
         their counts, ordered by count.
+        The count of a word is the number of feedbacks that contain the word (as a whole word).
         The word count uses stemming: words that get stemmed to the same word are counted together.
         If two or more words get stemmed to the same word, the word that appears first in 
         the feedback is chosen as key and all others are counted towards the same key.
+        The counts are computed in one pass over the feedback, stemming each distinct word once.
         """
         if self.word_counts is not None:
             return self.word_counts
         
         if self.preprocessed_feedback is None:
             self._get_preprocessed_feedback()
-        if self.stemmed_feedback is None:
-            self._get_stemmed_feedback()
 
-        # get unique words
-        words = set()
+        # in one pass over the feedback: stem -> [first word with this stem, number of feedbacks
+        # containing a word with this stem]
+        stem_counts = {}
         for f in self.preprocessed_feedback["Feedback"]:
-            words.update(f.split())
-        # merge words that get stemmed to the same word
-        for w1 in words.copy():
-            for w2 in words.copy():
-                if w1 in words and w2 in words and w1 != w2 and self.stemmer.stem(w1) == self.stemmer.stem(w2):
-                    words.remove(w2)
-        # count words in the stemmed feedback
-        word_counts = {}
-        for w in words:
-            word_counts[w] = 0
-            stemmed_w = self.stemmer.stem(w)
-            for f in self.stemmed_feedback["Feedback"]:
-                if stemmed_w in f:
-                    word_counts[w] += 1
-
-        # sort by count
-        word_counts = dict(sorted(word_counts.items(), key=lambda item: item[1], reverse=True))
+            stems = set()
+            for word in f.split():
+                stem = self._stem(word)
+                if stem not in stem_counts:
+                    stem_counts[stem] = [word, 0]
+                stems.add(stem)
+            for stem in stems:
+                stem_counts[stem][1] += 1
+
+        # sort by count (words with the same count stay in order of appearance)
+        word_counts = dict(sorted(stem_counts.values(), key=lambda item: item[1], reverse=True))
         self.word_counts = word_counts
         return word_counts
+
+    def _stem(self, word):
+        """
+        word: a preprocessed word (string)
+        Returns the stem of the word, stemming each distinct word only once.
+        """
+        stem = self.stems.get(word)
+        if stem is None:
+            stem = self.stemmer.stem(word)
+            self.stems[word] = stem
+        return stem
     
     def get_top_words(self, n):
         """
@@ -755,17 +792,52 @@ class HospitalData:
         If the question has a standard list, returns the answers in the order of the standard list 
         and sets the count to 0 if the answer is not in the data.
         """
+        return self.get_multiple_choices([question_id])[question_id]
+
+    def get_multiple_choices(self, question_ids=None, category=None):
+        """
+        question_ids: list of IDs of multiple choice questions (default: all questions of the
+        category if a category is given, otherwise all columns)
+        category: category of the questions, used if question_ids is not given (string)
+        Returns the answers to each question in a dictionary with the question IDs as keys and
+        the answers as values, in the format and order of get_multiple_choice() (None for the 
+        questions for which get_multiple_choice() returns None).
+        Each question is counted with a single pass over its column.
+        """
+        if question_ids is None:
+            if category is None:
+                question_ids = self.df.columns.tolist()
+            else:
+                question_ids = self.config.get_columns_of_category(category)
+        return {question_id: self._count_answers(question_id) for question_id in question_ids}
+
+    def _count_answers(self, question_id):
+        """
+        question_id: the ID of the multiple choice question (string)
+        Returns the answers to the question and their counts (see get_multiple_choice()).
+        """
         if question_id not in self.df.columns:
             return None
         question_type = self.config.get_category_of_column(question_id)
         if question_type == "open_feedack" or question_type == "info":
             return None
 
-        unique_answers = self.df[question_id].unique()
+        # count of every answer (null values are in the unique answers but are never counted)
+        value_counts = self.df[question_id].value_counts(dropna=False)
+        # the months of "Year-Month" are periods, they are returned as strings "YYYY-MM"
+        if any(isinstance(answer, pd.Period) for answer in value_counts.index):
+            value_counts.index = pd.Index([answer.strftime("%Y-%m") if isinstance(answer, pd.Period)
+                                           else answer for answer in value_counts.index], dtype=object)
+        unique_answers = value_counts.index.tolist()
+        counts = dict(zip(unique_answers, value_counts.to_numpy()))
+        for answer in unique_answers:
+            if pd.isna(answer):
+                counts[answer] = 0
+
         answers_list = self.config.get_answer_list(question_id)
         # if there is no answer list or the unique answers are not part of the answer list
         if answers_list is None or len(answers_list) == 0 or not set(unique_answers).issubset(set(answers_list)):
-            answers_list = self.df[question_id].unique().tolist()
+            answers_list = unique_answers
             # order alphabetically
             answers_list.sort()
             # if "Other" is in the list, move it to the end
@@ -777,33 +849,375 @@ class HospitalData:
                 answers_list.append("Prefer not to answer")
         answers = {}
         for a in answers_list:
-            answers[a] = len(self.df[self.df[question_id] == a])
+            answers[a] = int(counts.get(a, 0))
         return answers
 
 
     #endregion
 
 
+class PreprocessedState:
+    """
+    Represents the data of a state for one data version, preprocessed with the steps that only
+    depend on each row. It is shared by the HospitalData objects of all hospitals of the state 
+    (see get_preprocessed_state()), which take their rows from it and only run the steps that
+    depend on the rows of the hospital.
+    """
+
+    def __init__(self, state_code, previous=None):
+        """
+        state_code: the state code (string)
+        previous: the PreprocessedState of the state for a previous data version (optional)
+        If the data starts with the rows of the previous version (e.g. new surveys were appended
+        to the file), only the new rows are preprocessed (see _get_reused_rows()). The censored
+        texts of the previous version are kept for the texts that are still in the data.
+        """
+        state_data = dl.get_partitioned_state_data(state_code)
+        if state_data is None:
+            raise ValueError("Invalid state: ", state_code)
+        df, config, self.version, self.partitions = state_data
+        self.state = state_code
+        self.config = Configuration(state_code, get_base_configuration(state_code, config, self.version))
+        
+        self.errors = []
+        self.warnings = []
+
+        # the data of the state is never modified
+        self.df = dl.restore_dtypes(df)
+        if self.df is df:
+            self.df = df.copy()
+        self._preprocess_config()
+
+        # fingerprints of the rows before they are preprocessed, computed on the compact data 
+        # types (hashing categoricals only hashes their categories)
+        self.row_hashes = pd.util.hash_pandas_object(df[self.df.columns.tolist()], index=False).to_numpy()
+        self.row_dtypes = self.df.dtypes
+        self.reused_rows = self._get_reused_rows(previous)
+        self.reused_version = previous.version if self.reused_rows > 0 else None
+        if self.reused_rows > 0:
+            self.df = self.df.iloc[self.reused_rows:]
+
+        self._preprocess_date()
+        self._standardize_answers()
+        if self.reused_rows > 0:
+            self.df = pd.concat([previous.df, self.df], ignore_index=True)
+
+        # censored texts of the open feedback, added as the hospitals are preprocessed
+        self.censored = self._get_reused_censored_texts(previous)
+
+    def get_hospital_df(self, hospital_url):
+        """
+        hospital_url: the hospital url (string) (lowercase, no spaces, no punctuation)
+        Returns a copy of the preprocessed rows of the hospital, or None if the hospital is
+        invalid.
+        """
+        if not dl.valid_hospital(self.state, hospital_url):
+            print("Invalid hospital: ", hospital_url, " for state: ", self.state)
+            return None
+        df = dl.take_hospital_rows(self.df, self.partitions, self.state, hospital_url)
+        if df is self.df:
+            df = df.copy()
+        return df
+
+    def _preprocess_config(self):
+        """
+        This should always be called before any other preprocessing steps as it modifies 
+        the configuration and could prevent errors in further steps.
+        It only depends on the columns of the data, which are the same for all hospitals.
+        Preprocessing steps based on the configuration:
+        - remove columns marked as "info"
+        - remove duplicate columns for categories which should only have one column
+        (and add a warning if there are more than one column for a category)
+        - remove duplicate question IDs
+        - remove columns marked as "_TEXT" unless they are open feedback or one of the
+        one column categories
+        - check that df columns match the configuration and delete not-matching columns
+        - check that all one column categories are present
+        - remove columns with unallowed categories and add a warning if there are any
+        """
+
+        # The columns to delete are collected in one pass and dropped from the dataframe at the end
+        columns = self.df.columns.tolist()
+        dropped = set()
+
+        # Remove columns marked as "info"
+        info_columns = self.config.get_columns_of_category("info")
+        if info_columns is not None and len(info_columns) > 0:
+            dropped.update(info_columns)
+            self.config.remove_columns(info_columns)
+        
+        # Remove duplicate columns for categories which should only have one column
+        for category in ONE_COLUMN_CATEGORIES:
+            category_columns = self.config.get_columns_of_category(category)
+            if len(category_columns) > 1:
+                self.warnings.append(f"{len(category_columns)} columns for category {category}. Only the first column will be kept.")
+                dropped.update(category_columns[1:])
+                self.config.remove_columns(category_columns[1:])
+        
+        # Remove questions with duplicate IDs
+        columns = [c for c in columns if c not in dropped]
+        duplicates = set([x for x, count in Counter(columns).items() if count > 1])
+        for d in duplicates:
+            self.warnings.append(f"Duplicate question ID: {d}. The question will be deleted.")
+            dropped.add(d)
+            self.config.remove_columns([d])
+        
+        # Remove columns that end as "_TEXT"
+        columns = [c for c in columns if c not in dropped]
+        text_columns = [c for c in columns if c.endswith("_TEXT")]
+        for c in text_columns:
+            if self.config.get_category_of_column(c) not in ["open_feedback"] and self.config.get_category_of_column(c) not in ONE_COLUMN_CATEGORIES:
+                dropped.add(c)
+                self.config.remove_columns([c])
+        
+        # Check that df columns match the configuration
+        columns = [c for c in columns if c not in dropped]
+        config_columns = set(self.config.get_ids())
+        for c in columns:
+            if c not in config_columns:
+                self.errors.append(f"An error occured with question {c}. The column will be deleted.")
+                dropped.add(c)
+        
+        # Check that all one column categories are present
+        categories = self.config.get_categories()
+        for category in ONE_COLUMN_CATEGORIES:
+            if category not in categories:
+                self.errors.append(f"Missing question category: {category}.")
+        
+        # Remove columns with unallowed categories
+        columns = [c for c in columns if c not in dropped]
+        for q_id in columns:
+            category = self.config.get_category_of_column(q_id)
+            if category not in ALLOWED_CATEGORIES:
+                self.warnings.append(f"Unallowed category for question {q_id}: {category}. The question will be deleted.")
+                dropped.add(q_id)
+                self.config.remove_columns([q_id])
+
+        if len(dropped) > 0:
+            self.df = self.df.drop(columns=list(dropped))
+
+    def _get_reused_rows(self, previous):
+        """
+        previous: the PreprocessedState of the state for a previous data version, or None
+        Returns the number of rows at the start of the data that are the same as the rows of the
+        previous version (same columns, data types and fingerprints), so that their preprocessed
+        rows can be reused. Returns 0 if the data does not start with all rows of the previous 
+        version (e.g. rows were modified or removed).
+        Only the row-local steps are reused: the steps that depend on all rows of a hospital 
+        (e.g. anonymization) are run again on the combined rows by HospitalData.
+        """
+        if previous is None or previous.state != self.state:
+            return 0
+        n_rows = len(previous.row_hashes)
+        if n_rows == 0 or n_rows > len(self.row_hashes) or not self.row_dtypes.equals(previous.row_dtypes):
+            return 0
+        if not np.array_equal(self.row_hashes[:n_rows], previous.row_hashes):
+            return 0
+        return n_rows
+
+    def _get_reused_censored_texts(self, previous):
+        """
+        previous: the PreprocessedState of the state for a previous data version, or None
+        Returns the censored texts of the previous version for the texts of the open feedback 
+        that are still in the data, so that they are not censored again.
+        """
+        if previous is None or previous.state != self.state:
+            return {}
+        # copied first, as the hospitals of the previous version could still be censoring texts
+        censored = dict(previous.censored)
+        if len(censored) == 0:
+            return censored
+        texts = set()
+        for column in self.config.get_columns_of_category("open_feedback"):
+            if column in self.df.columns:
+                texts.update(self.df[column].dropna().unique())
+        return {text: censored_text for text, censored_text in censored.items() if text in texts}
+
+    def _preprocess_date(self):
+        """
+        Adds a column "Year-Month" with the month of the date (pandas monthly period) if the 
+        dates are already in datetime format, which is the case unless the dates have different
+        formats (see data_loader._compact_frame()).
+        Dates with different formats are parsed for each hospital instead (see 
+        HospitalData._preprocess_date()): pandas detects the format from the first date, so 
+        parsing them for the whole state could give different dates.
+        """
+        self.date_column = self.config.get_columns_of_category("date")[0]
+        dates = self.df[self.date_column]
+        self.dates_preprocessed = pd.api.types.is_datetime64_any_dtype(dates)
+        if self.dates_preprocessed:
+            self.df["Year-Month"] = dates.dt.to_period("M")
+
+    def _standardize_answers(self):
+        """
+        Replaces the answers in STANDARD_ANSWERS in all text columns (except the date column,
+        which is parsed before the answers are standardized).
+        Only the matching values are written and the columns keep their data type (unlike with
+        DataFrame.replace(), which infers the data types of the text columns again), so that the
+        rows of each hospital have the data types of the state frame.
+        """
+        for i, dtype in enumerate(self.df.dtypes):
+            if dtype != object or self.df.columns[i] == self.date_column:
+                continue
+            column = self.df.iloc[:, i]
+            # the values are compared as a numpy array, which is faster than comparing the Series
+            values = column.to_numpy()
+            replaced = None
+            for answer, standard_answer in STANDARD_ANSWERS.items():
+                replace = values == answer
+                if replace.any():
+                    if replaced is None:
+                        replaced = values.copy()
+                    replaced[replace] = standard_answer
+            if replaced is not None:
+                self.df.isetitem(i, pd.Series(replaced, index=column.index, dtype=object))
+
+    def censor_texts(self, texts):
+        """
+        texts: the texts to censor (list)
+        Censors the texts that were not censored yet for the state. The texts are first looked 
+        up in the persistent cache (see get_censor_cache()), the others are streamed through the
+        spaCy pipeline in batches of CENSOR_BATCH_SIZE texts (in CENSOR_N_PROCESS processes) with
+        only the components needed to recognize the entities and added to the cache. The
+        censored texts are then returned by censor(). Values that are not strings are left to 
+        censor().
+        """
+        texts = [text for text in dict.fromkeys(texts) 
+                 if isinstance(text, str) and text not in self.censored]
+        if len(texts) == 0:
+            return
+
+        # texts censored before (also by other processes) are taken from the persistent cache
+        cache = get_censor_cache()
+        model_version = _get_censor_model_version()
+        cached = cache.get_many(texts, model_version)
+        self.censored.update(cached)
+        texts = [text for text in texts if text not in cached]
+        if len(texts) == 0:
+            return
+
+        n_process = CENSOR_N_PROCESS if len(texts) > CENSOR_BATCH_SIZE else 1
+        docs = nlp.pipe(texts, batch_size=CENSOR_BATCH_SIZE, n_process=n_process, 
+                        disable=_get_unused_pipes())
+        censored = {text: _censor_doc(doc) for text, doc in zip(texts, docs)}
+        self.censored.update(censored)
+        cache.put_many(censored, model_version)
+
+    def censor(self, text):
+        """
+        text: the text to censor (string)
+        Returns the text with the entities censored (see _censor_entities()), censoring each 
+        distinct text only once for the state.
+        """
+        if pd.isna(text):
+            return text
+        censored_text = self.censored.get(text)
+        if censored_text is None:
+            censored_text = _censor_entities(text)
+            self.censored[text] = censored_text
+        return censored_text
+
+
+# spaces before ".", ",", "?", "!", ":", ";", ")", "]", "}", "'" and after "(", "[", "{", "'"
+_SPACE_BEFORE_PUNCTUATION = re.compile(r'\s([.,?!:;)\]}\'"])')
+_SPACE_AFTER_PUNCTUATION = re.compile(r'([(\[{\'"]) ')
+
+def _censor_entities(text):
+    """
+    text: the text to censor (string)
+    Returns text with the entities censored with underscores.
+    """
+    if pd.isna(text):
+        return text
+    return _censor_doc(nlp(text, disable=_get_unused_pipes()))
+
+def _censor_doc(doc):
+    """
+    doc: the spaCy doc of a text
+    Returns the text of the doc with the entities censored with underscores.
+    """
+    censored_text = ' '.join(['_' if token.ent_type_ else token.text for token in doc])
+    censored_text = _SPACE_BEFORE_PUNCTUATION.sub(r'\1', censored_text)
+    censored_text = _SPACE_AFTER_PUNCTUATION.sub(r'\1', censored_text)
+    return censored_text
+
+def _get_censor_model_version():
+    """
+    Returns the version of the censoring the censored texts are stored with in the persistent
+    cache: the versions of spaCy and of the model, and CENSOR_FORMAT_VERSION.
+    """
+    meta = nlp.meta
+    return (f"spacy-{spacy.__version__}/{meta.get('lang')}_{meta.get('name')}-{meta.get('version')}"
+            f"/{CENSOR_FORMAT_VERSION}")
+
+def _get_unused_pipes():
+    """
+    Returns the names of the components of the spaCy pipeline that are not needed to recognize
+    the entities (e.g. tagger, parser, lemmatizer), which are disabled when censoring. The
+    components the entity recognizer listens to (e.g. a shared tok2vec) are kept.
+    """
+    needed = {"ner", "entity_ruler"}
+    for name, pipe in nlp.pipeline:
+        if needed & set(getattr(pipe, "listening_components", [])):
+            needed.add(name)
+    return [name for name in nlp.pipe_names if name not in needed]
+
+# English stopwords removed from the feedback for the word counts, loaded on first use
+_STOP_WORDS = None
+
+def _get_stop_words():
+    """
+    Returns the set of English stopwords (loaded from nltk only once).
+    """
+    global _STOP_WORDS
+    if _STOP_WORDS is None:
+        _STOP_WORDS = set(stopwords.words('english'))
+    return _STOP_WORDS
+
+
 class Configuration:
     """
     Represents the configuration for a state (configuration is identical for all hospitals
     in the same state).
     Provides methods to access the configuration.
+    The configuration of the state is a BaseConfiguration shared by all hospitals of the state,
+    which is never modified: the columns removed for a hospital and the answer lists set for it
+    are only stored in this object.
     """
 
-    def __init__(self, state_code):
+    def __init__(self, state_code, base=None):
         """
         state_code: the state code (string)
+        base: the BaseConfiguration of the state (by default the one of its current data version)
         """
         self.state = state_code
-        self.config = dl.get_config(state_code)
-        self.config = self.config._append(
-            {"ID": "Year-Month", "Text": "Year-Month", "Category": "Year-Month"},
-            ignore_index=True)
-        self.config["Answer_List"] = [AnswerList([]) for _ in range(len(self.config))]
-        # add new row
-        if self.config is None:
+        self.base = base if base is not None else get_base_configuration(state_code)
+        if self.base is None:
             raise ValueError("Invalid state: ", state_code)
+        # IDs of the columns removed from the configuration
+        self.removed = set()
+        # answer lists set with set_answer_list() by ID (other columns have no answer list)
+        self.answer_lists = {}
+
+    def copy(self):
+        """
+        Returns a copy of the configuration with the same BaseConfiguration, whose removed columns
+        and answer lists can be changed independently.
+        """
+        config = Configuration(self.state, self.base)
+        config.removed = set(self.removed)
+        config.answer_lists = dict(self.answer_lists)
+        return config
+
+    def _get_column(self, id):
+        """
+        id: column ID (string)
+        Returns the ConfigColumn of a given column ID.
+        Raises a KeyError if the column is not in the configuration.
+        """
+        if id in self.removed:
+            raise KeyError(id)
+        return self.base.columns_by_id[id]
     
     #region Column Categories
 
@@ -812,7 +1226,7 @@ class Configuration:
         category: column category (string)
         Returns a list of column IDs of a given category.
         """
-        return self.config[self.config["Category"] == category]["ID"].tolist()
+        return [id for id in self.base.ids_by_category.get(category, ()) if id not in self.removed]
 
     def get_columns_of_categories(self, categories):
         """
@@ -829,7 +1243,7 @@ class Configuration:
         column: column ID (string)
         Returns the category of a given column ID.
         """
-        return self.config[self.config["ID"] == column]["Category"].values[0]
+        return self._get_column(column).category
 
     #endregion
 
@@ -839,27 +1253,29 @@ class Configuration:
         """
         Returns a list of all column IDs in the configuration.
         """
-        return self.config["ID"].tolist()
+        return [id for id in self.base.ids if id not in self.removed]
     
     def get_categories(self):
         """
         Returns a list of all categories in the configuration.
         """
-        return self.config["Category"].unique().tolist()
+        return [category for category, ids in self.base.ids_by_category.items()
+                if any(id not in self.removed for id in ids)]
     
     def get_question_text(self, id):
         """
         id: the ID of the question (string)
         Returns the text of the question with the given ID.
         """
-        return self.config[self.config["ID"] == id]["Text"].values[0]
+        return self._get_column(id).text
     
     def get_answer_list(self, id):
         """
         id: the ID of the question (string)
         Returns the answer list for the question with the given ID.
         """
-        return self.config[self.config["ID"] == id]["Answer_List"].values[0].answers
+        self._get_column(id)
+        return self.answer_lists.get(id, EMPTY_ANSWER_LIST).answers
 
     #endregion
 
@@ -870,7 +1286,7 @@ class Configuration:
         columns: list of column IDs to remove
         Removes the columns from the configuration.
         """
-        self.config = self.config[~self.config["ID"].isin(columns)]
+        self.removed.update(columns)
     
     def set_answer_list(self, id, answer_list):
         """
@@ -878,13 +1294,243 @@ class Configuration:
         answer_list: the list of answers for the question
         Sets the answer list for the question with the given ID.
         """
-        self.config.loc[self.config["ID"] == id, "Answer_List"] = AnswerList(answer_list)
+        if id in self.base.columns_by_id and id not in self.removed:
+            self.answer_lists[id] = AnswerList(answer_list)
 
     #endregion
 
 
+class BaseConfiguration:
+    """
+    Configuration of a state for one data version, with the columns indexed by ID and category.
+    It is shared by the Configuration objects of all hospitals of the state and must not be
+    modified.
+    """
+
+    def __init__(self, config):
+        """
+        config: the configuration dataframe of the state (see data_loader.get_config())
+        """
+        # records of the columns in the order of the configuration, with the added "Year-Month"
+        # column at the end
+        columns = [ConfigColumn(id, text, category) for id, text, category
+                   in zip(config["ID"].tolist(), config["Text"].tolist(), config["Category"].tolist())]
+        columns.append(ConfigColumn("Year-Month", "Year-Month", "Year-Month"))
+        self.columns = tuple(columns)
+        self.ids = tuple(column.id for column in self.columns)
+        # record of the columns by ID (the configuration can contain duplicate IDs: the first
+        # record is used, while removing an ID removes all of them)
+        self.columns_by_id = {}
+        # IDs of the columns by category, in the order of the configuration
+        ids_by_category = {}
+        for column in self.columns:
+            self.columns_by_id.setdefault(column.id, column)
+            ids_by_category.setdefault(column.category, []).append(column.id)
+        self.ids_by_category = {category: tuple(ids) for category, ids in ids_by_category.items()}
+
+
+class ConfigColumn:
+    """
+    Configuration of a column: ID, question text and category.
+    """
+    __slots__ = ("id", "text", "category")
+
+    def __init__(self, id, text, category):
+        self.id = id
+        self.text = text
+        self.category = category
+
+
 class AnswerList:
     def __init__(self, answers):
         self.answers = answers
 
+
+# Answer list of the columns without one (shared by all configurations, must not be modified)
+EMPTY_ANSWER_LIST = AnswerList([])
+
+# BaseConfiguration of each state with its data version: state -> (version, base configuration)
+_BASE_CONFIGURATIONS = {}
+
+def get_base_configuration(state_code, config=None, version=None):
+    """
+    state_code: the state code (string)
+    config, version: the configuration dataframe of the state and its data version (by default
+    the ones currently loaded)
+    Returns the BaseConfiguration of the state for the data version, building it only once per
+    version.
+    Returns None if the state is invalid.
+    """
+    if config is None:
+        state_data = dl.get_state_data(state_code)
+        if state_data is None:
+            return None
+        _, config, version = state_data
+    cached = _BASE_CONFIGURATIONS.get(state_code)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    # (two requests can build the same configuration at once: either one can be kept)
+    base = BaseConfiguration(config)
+    _BASE_CONFIGURATIONS[state_code] = (version, base)
+    return base
+
+
+#region PreprocessedState cache
+
+# PreprocessedState of each state for its latest data version
+_PREPROCESSED_STATES = {}
+_PREPROCESSED_STATES_LOCK = threading.Lock()
+# Locks of the states, so that each state is only preprocessed once per data version
+_PREPROCESSED_STATE_LOCKS = {}
+
+def get_preprocessed_state(state_code):
+    """
+    state_code: the state code (string)
+    Returns the PreprocessedState of the state for its current data version, preprocessing the
+    state only once per version (reusing the rows of the previous version, see 
+    PreprocessedState._get_reused_rows()).
+    Returns None if the state is invalid.
+    """
+    # loads the state if needed, so that the version is the one of the data used below
+    state_data = dl.get_state_data(state_code)
+    if state_data is None:
+        return None
+    
+    with _PREPROCESSED_STATES_LOCK:
+        lock = _PREPROCESSED_STATE_LOCKS.setdefault(state_code, threading.Lock())
+    with lock:
+        preprocessed = _PREPROCESSED_STATES.get(state_code)
+        if preprocessed is None or preprocessed.version != state_data[2]:
+            # the rows of the previous version are reused if new rows were only appended
+            preprocessed = PreprocessedState(state_code, preprocessed)
+            _PREPROCESSED_STATES[state_code] = preprocessed
+            # the copy of the data with the standard data types counts in the memory budget of 
+            # the state (see invalidate_hospital_data() for its eviction)
+            dl.add_state_memory(state_code, preprocessed.version, 
+                                int(preprocessed.df.memory_usage(deep=True).sum()))
+    return preprocessed
+
+#endregion
+
+#region Censor cache
+
+# Persistent cache of the censored texts, opened on first use
+_CENSOR_CACHE = None
+_CENSOR_CACHE_LOCK = threading.Lock()
+
+def get_censor_cache():
+    """
+    Returns the persistent cache of the censored texts (see censor_cache.CensorCache), stored 
+    in CENSOR_CACHE_FILE in the cache directory of the data_loader module.
+    """
+    global _CENSOR_CACHE
+    path = os.path.join(dl.CACHE_PATH, CENSOR_CACHE_FILE)
+    with _CENSOR_CACHE_LOCK:
+        if _CENSOR_CACHE is None or _CENSOR_CACHE.path != path:
+            _CENSOR_CACHE = cc.CensorCache(path)
+        return _CENSOR_CACHE
+
+def get_censor_cache_stats():
+    """
+    Returns a dictionary with the number of hits and misses of the persistent cache of the 
+    censored texts in this process, its hit rate, its number of entries and its size in bytes.
+    """
+    return get_censor_cache().get_stats()
+
+#endregion
+
+#region HospitalData cache
+
+# Preprocessed HospitalData objects by (state, hospital, data version), least recently used first
+_HOSPITAL_DATA_CACHE = OrderedDict()
+# Number of lookups found in the cache, of lookups that preprocessed the data and of evictions
+HOSPITAL_DATA_CACHE_STATS = {"hits": 0, "misses": 0, "evictions": 0}
+_HOSPITAL_DATA_LOCK = threading.Lock()
+# Locks for the keys being preprocessed, so that each hospital is only preprocessed once
+_HOSPITAL_DATA_BUILDING = {}
+
+def get_hospital_data(state_code, hospital_url):
+    """
+    state_code: the state code (string)
+    hospital_url: the hospital url (string) (lowercase, no spaces, no punctuation)
+    Returns the preprocessed HospitalData for the state and hospital, from the cache if it was
+    already preprocessed for the current data version of the state.
+    Raises a ValueError if the state or hospital are invalid (see HospitalData).
+    """
+    # loads the state if needed, so that the version is the one of the data used below
+    state_data = dl.get_state_data(state_code)
+    if state_data is None:
+        raise ValueError("Invalid state or hospital: ", state_code, hospital_url)
+    key = (state_code, hospital_url, state_data[2])
+
+    with _HOSPITAL_DATA_LOCK:
+        if key in _HOSPITAL_DATA_CACHE:
+            HOSPITAL_DATA_CACHE_STATS["hits"] += 1
+            _HOSPITAL_DATA_CACHE.move_to_end(key)
+            return _HOSPITAL_DATA_CACHE[key]
+        building = _HOSPITAL_DATA_BUILDING.setdefault(key, threading.Lock())
+        # an older version of the hospital, whose aggregates can be updated with the new rows
+        previous = next((v for k, v in _HOSPITAL_DATA_CACHE.items() if k[:2] == key[:2]), None)
+
+    with building:
+        # another request could have preprocessed the data in the meantime
+        with _HOSPITAL_DATA_LOCK:
+            if key in _HOSPITAL_DATA_CACHE:
+                HOSPITAL_DATA_CACHE_STATS["hits"] += 1
+                _HOSPITAL_DATA_CACHE.move_to_end(key)
+                return _HOSPITAL_DATA_CACHE[key]
+        try:
+            hospital_data = HospitalData(state_code, hospital_url, previous)
+            with _HOSPITAL_DATA_LOCK:
+                HOSPITAL_DATA_CACHE_STATS["misses"] += 1
+                # older versions of the same hospital will not be requested again
+                for old_key in [k for k in _HOSPITAL_DATA_CACHE if k[:2] == key[:2]]:
+                    del _HOSPITAL_DATA_CACHE[old_key]
+                _HOSPITAL_DATA_CACHE[key] = hospital_data
+                while len(_HOSPITAL_DATA_CACHE) > HOSPITAL_DATA_CACHE_SIZE:
+                    _HOSPITAL_DATA_CACHE.popitem(last=False)
+                    HOSPITAL_DATA_CACHE_STATS["evictions"] += 1
+        finally:
+            with _HOSPITAL_DATA_LOCK:
+                _HOSPITAL_DATA_BUILDING.pop(key, None)
+    return hospital_data
+
+def invalidate_hospital_data(state_code=None, hospital_url=None):
+    """
+    state_code: the state code (string), or None for all states
+    hospital_url: the hospital url (string), or None for all hospitals of the state
+    Removes the cached HospitalData objects of the given state and hospital, so that they are 
+    preprocessed again on the next request.
+    """
+    with _HOSPITAL_DATA_LOCK:
+        for key in list(_HOSPITAL_DATA_CACHE):
+            if state_code is not None and key[0] != state_code:
+                continue
+            if hospital_url is not None and key[1] != hospital_url:
+                continue
+            del _HOSPITAL_DATA_CACHE[key]
+    # the preprocessed state is only shared by the hospitals of the state
+    if hospital_url is None:
+        with _PREPROCESSED_STATES_LOCK:
+            for state in list(_PREPROCESSED_STATES):
+                if state_code is None or state == state_code:
+                    del _PREPROCESSED_STATES[state]
+
+# the HospitalData objects and the PreprocessedState of a state evicted by the data_loader module
+# are removed with it, so that their copies of the data of the state are freed (they are
+# preprocessed again when the state is loaded again)
+dl.add_eviction_callback(invalidate_hospital_data)
+
+def get_hospital_data_cache_stats():
+    """
+    Returns a dictionary with the number of hits, misses and evictions of the HospitalData 
+    cache and the number of cached objects.
+    """
+    with _HOSPITAL_DATA_LOCK:
+        stats = dict(HOSPITAL_DATA_CACHE_STATS)
+        stats["size"] = len(_HOSPITAL_DATA_CACHE)
+    return stats
+
+#endregion
+
 #empty space
\ No newline at end of file